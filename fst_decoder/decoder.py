@@ -0,0 +1,2649 @@
+"""
+Implementation of fst_decoder.py: models, search, configuration and batch decoding.
+It lives in an importable module, so Python caches its bytecode; fst_decoder.py is
+only the entry point, and the server mode is in decoder_server.py.
+"""
+
+import os
+import re
+import abc
+import mmap
+import sys
+import json
+import argparse
+import _thread
+import time
+import pickle
+import struct
+import hashlib
+import heapq
+from array import array
+from bisect import bisect_left
+from collections import deque, Counter, OrderedDict
+from contextlib import contextmanager, nullcontext
+from itertools import product
+from typing import List, Dict, Any, Optional, Tuple
+import pywrapfst as fst
+import pynini
+
+class DecoderLog:
+    """Leveled diagnostics, written as plain messages or as JSON lines.
+
+    Messages below the configured level are dropped after one integer
+    comparison. Hot paths check debug_enabled or sample_every before
+    building a message, so disabled per-sentence diagnostics cost nothing.
+    """
+    LEVELS = {'debug': 10, 'info': 20, 'warning': 30, 'error': 40}
+
+    def __init__(self):
+        self.level = self.LEVELS['info']
+        self.debug_enabled = False
+        self.json_lines = False
+        self.stream = sys.stderr
+        self.log_file = None
+        # Log every sample_every-th decoded sentence (0: none)
+        self.sample_every = 0
+        self.sentences = 0
+        # A lock from _thread, so that runs without the server do not import threading
+        self.lock = _thread.allocate_lock()
+
+    def configure(self, level: str = 'info', log_format: str = 'text', log_file: str = None,
+                  sample_rate: float = 0.0):
+        if level not in self.LEVELS:
+            raise ConfigError(f"Unknown log level: {level}")
+        if log_format not in ('text', 'json'):
+            raise ConfigError(f"Unknown log format: {log_format}")
+        self.level = self.LEVELS[level]
+        self.debug_enabled = self.level <= self.LEVELS['debug']
+        self.json_lines = log_format == 'json'
+        if log_file != self.log_file:
+            self.close()
+            if log_file:
+                # Line buffered: forked workers leave with os._exit, which skips flushing
+                self.stream = open(log_file, 'a', buffering=1, encoding='utf-8')
+                self.log_file = log_file
+        self.sample_every = max(1, int(round(1.0 / sample_rate))) if sample_rate > 0 else 0
+
+    def sample(self) -> bool:
+        """Whether the diagnostics of the sentence just decoded are logged"""
+        self.sentences += 1
+        return self.sentences % self.sample_every == 0
+
+    def debug(self, message: str, **fields):
+        if self.level <= 10:
+            self._write('debug', message, fields)
+
+    def info(self, message: str, **fields):
+        if self.level <= 20:
+            self._write('info', message, fields)
+
+    def warning(self, message: str, **fields):
+        if self.level <= 30:
+            self._write('warning', message, fields)
+
+    def error(self, message: str, **fields):
+        self._write('error', message, fields)
+
+    def flush(self):
+        with self.lock:
+            self.stream.flush()
+
+    def close(self):
+        """Close the log file, if any, and go back to stderr"""
+        with self.lock:
+            if self.stream is not sys.stderr:
+                self.stream.close()
+                self.stream = sys.stderr
+                self.log_file = None
+
+    def _write(self, level: str, message: str, fields: Dict):
+        if self.json_lines:
+            record = {'time': round(time.time(), 6), 'level': level, 'pid': os.getpid(), 'message': message}
+            record.update(fields)
+            line = json.dumps(record, ensure_ascii=False, default=str)
+        else:
+            line = message
+        with self.lock:
+            self.stream.write(line + "\n")
+
+_log = DecoderLog()
+
+class ConfigError(Exception):
+    pass
+
+class DecoderError(Exception):
+    pass
+
+# Model types selectable with `type:` in a model's config, filled by register_model_type
+MODEL_TYPES = {}
+
+def register_model_type(name: str):
+    """Class decorator registering a model implementation under a config type name"""
+    def register(cls):
+        MODEL_TYPES[name] = cls
+        return cls
+    return register
+
+class Model(abc.ABC):
+    """Interface shared by all model types.
+
+    A model is loaded (and optionally prepared) once, scaled by its
+    log-linear weight, and then searched as part of the cascade. SEARCH tells
+    the decoder how: 'eager' models are composed with the input by pynini,
+    and a model with a whole-sentence search ('viterbi', 'trie') must be the
+    only model; the decoder calls its prepare_search() once and its search()
+    per sentence. SEARCH_INPUT says what search() reads: input labels, or the
+    tokens as they are.
+    """
+
+    SEARCH = 'eager'
+    SEARCH_INPUT = 'labels'
+
+    def __init__(self, config, symbol_tables=None, bundle_entry=None):
+        self.config = config
+        self.symbol_tables = symbol_tables or {}
+        self.bundle_entry = bundle_entry
+        self.fst = None
+        self.weight = 1.0
+        # Load-time optimization steps (None to load the model as it is) and where results are cached
+        self.prepare_options = None
+        self.prepare_cache_dir = None
+
+    @abc.abstractmethod
+    def load(self):
+        """Load the model from its files, or from bundle_entry when it came from a bundle"""
+
+    @abc.abstractmethod
+    def verify(self):
+        """Raise ConfigError unless the loaded model can be searched"""
+
+    @abc.abstractmethod
+    def apply_weight(self, weight: float):
+        """Scale the model by its log-linear weight"""
+
+    @abc.abstractmethod
+    def to_bundle_entry(self) -> Dict:
+        """What load() needs to rebuild the model from a bundle"""
+
+    def compose(self, lattice, weight: float = None):
+        """Compose an input FST or lattice with the model, scaled by weight instead of its own if given"""
+        raise ConfigError(f"A {self.SEARCH} model cannot be composed with an FST")
+
+    def resolve_prepare(self, prepare) -> Optional[Dict]:
+        """The load-time optimization steps a prepare setting asks for, None for none"""
+        return None
+
+    def prepare_search(self, search: str, options: Dict):
+        """Build what the whole-sentence search needs, once at load.
+
+        search is the model's SEARCH, or the engine forcing one; options are
+        the decoder's resolved options. Raises ConfigError when the model
+        cannot be searched that way.
+        """
+        raise ConfigError(f"A {self.SEARCH} model has no {search} search")
+
+    def search(self, sentence: List, nbest: int) -> Optional[List[Tuple[List[int], float]]]:
+        """Search a whole sentence, read as SEARCH_INPUT says.
+
+        Returns the hypotheses as (output labels, cost) pairs, best first and
+        empty when there is no path, or None when the search cannot decide and
+        the sentence is composed with pynini instead.
+        """
+        raise DecoderError(f"A {self.SEARCH} model has no whole-sentence search")
+
+    def label_symbols(self) -> Optional[Tuple[Any, Any]]:
+        """Input and output symbol tables of the model's labels, to reconcile with
+        its neighbours; None when the model reads the decoder's tables directly"""
+        return None
+
+    def relabel(self, input_symbols=None, output_symbols=None) -> bool:
+        """Move the model onto the given label spaces; returns whether any label changed"""
+        return False
+
+    def convert(self, directory: str) -> Dict:
+        """Write the model in its fastest-loading form to directory and return
+        its config there; models without one keep their config"""
+        return dict(self.config)
+
+    def memory_stats(self) -> Dict[str, int]:
+        """KiB of the model's memory-mapped files: mapped, resident and shared"""
+        return {}
+
+    def _read_symbols(self, symbol_file: str):
+        """Read a symbol table, reusing the decoder's copy when it was read from the same file"""
+        for table in self.symbol_tables.values():
+            if table is not None and table.name() == symbol_file:
+                return table
+        return pynini.SymbolTable.read_text(symbol_file)
+
+@register_model_type('plain')
+class FSTModel(Model):
+    """FST model held as a mutable vector FST and composed eagerly with pynini"""
+
+    # OpenFst type the model is held in
+    FST_TYPE = 'vector'
+    # Optimizations run by prepare: true; a prepare mapping overrides single steps
+    PREPARE_DEFAULTS = {'rmepsilon': True, 'determinize': 'encode', 'minimize': True, 'push': True}
+    DETERMINIZE_TYPES = ('encode', 'functional', 'disambiguate')
+    # Bumped when the pipeline changes, so stale cached models are not reused
+    PREPARE_VERSION = 1
+
+    def __init__(self, config, symbol_tables=None, bundle_entry=None):
+        """Initialize the FST model with configuration"""
+        super().__init__(config, symbol_tables, bundle_entry)
+        # Unscaled FST and its copies scaled by a log-linear weight
+        self.base_fst = None
+        self.scaled_fsts = {}
+        # (old, new) label pairs applied to reconcile the model with the decoder's label spaces
+        self.relabel_ipairs = []
+        self.relabel_opairs = []
+        self.csr = None
+        
+    def load(self):
+        """Load the FST with explicit symbol tables"""
+        if self.bundle_entry is not None:
+            # Precompiled bundle: arc-sorted FST with its symbol tables embedded
+            try:
+                self.fst = pynini.Fst.read_from_string(self.bundle_entry['fst'])
+            except Exception as e:
+                raise ConfigError(f"Failed to read FST from bundle: {str(e)}")
+            for side in self.bundle_entry.get('shared_symbols', ()):
+                if side == 'input':
+                    self.fst.set_input_symbols(self.symbol_tables['input'])
+                else:
+                    self.fst.set_output_symbols(self.symbol_tables['output'])
+            self.base_fst = self.fst
+            _log.info(f"Loaded FST from bundle with {self.fst.num_states()} states")
+            return
+
+        try:
+            fst_file = self.config.get('file')
+            if not fst_file:
+                raise ConfigError("No FST file specified in config")
+                
+            if not os.path.exists(fst_file):
+                raise ConfigError(f"FST file not found: {fst_file}")
+
+            prepared_file = self._prepared_cache_file() if self.prepare_options else None
+            if prepared_file and os.path.exists(prepared_file) and self._load_prepared(prepared_file):
+                return
+
+            _log.debug(f"Attempting to load FST from: {fst_file}")
+            
+            # Load FST first
+            try:
+                if self.FST_TYPE == 'const':
+                    self.fst = self._read_const(fst_file)
+                else:
+                    self.fst = pynini.Fst.read(fst_file)
+            except Exception as e:
+                raise ConfigError(f"Failed to read FST file {fst_file}: {str(e)}")
+                
+            if self.fst.start() == -1:
+                raise ConfigError("Loaded FST has no start state")
+
+            if not isinstance(self.fst, pynini.Fst):
+                # A const FST is immutable and keeps the symbol tables it was converted with
+                if self.fst.input_symbols() is None or self.fst.output_symbols() is None:
+                    _log.warning(f"Warning: const FST {fst_file} has no symbol tables; "
+                                 f"convert it with --convert-models to embed them")
+            else:
+                # Attach symbol tables if paths are provided
+                input_sym_path = self.config.get('input_symbols')
+                if input_sym_path:
+                    if not os.path.exists(input_sym_path):
+                        _log.warning(f"Warning: Input symbol table not found: {input_sym_path}")
+                    else:
+                        self.fst.set_input_symbols(self._read_symbols(input_sym_path))
+
+                output_sym_path = self.config.get('output_symbols')
+                if output_sym_path:
+                    if not os.path.exists(output_sym_path):
+                        _log.warning(f"Warning: Output symbol table not found: {output_sym_path}")
+                    else:
+                        self.fst.set_output_symbols(self._read_symbols(output_sym_path))
+                
+            self.base_fst = self.fst
+            _log.info(f"Successfully loaded {self.fst.fst_type()} FST with {_num_states(self.fst)} states")
+            if prepared_file:
+                self._prepare(prepared_file)
+            _log.debug(f"Input symbols: {'yes' if self.fst.input_symbols() else 'no'}")
+            _log.debug(f"Output symbols: {'yes' if self.fst.output_symbols() else 'no'}")
+            
+        except Exception as e:
+            raise ConfigError(f"Error loading FST: {str(e)}")
+
+    @staticmethod
+    def _read_const(fst_file: str):
+        """Read a const FST as it is, without the VectorFst copy pynini.Fst.read makes"""
+        const_fst = fst.Fst.read(fst_file)
+        if const_fst.fst_type() != 'const':
+            _log.warning(f"Warning: {fst_file} is a {const_fst.fst_type()} FST; converting it to const")
+            const_fst = fst.convert(const_fst, 'const')
+        return const_fst
+
+    def _mutable_base(self):
+        """The unscaled FST as a mutable VectorFst, copying a const model into private memory"""
+        if not isinstance(self.base_fst, pynini.Fst):
+            _log.info(f"Copying const model {self.config.get('file')} into a mutable FST")
+            self.base_fst = pynini.Fst.from_pywrapfst(self.base_fst)
+        return self.base_fst
+
+    def const_fst(self):
+        """The unscaled model as an input-label-sorted const FST"""
+        if not isinstance(self.base_fst, pynini.Fst):
+            return self.base_fst
+        sorted_fst = self.base_fst
+        if not sorted_fst.properties(fst.I_LABEL_SORTED, True):
+            sorted_fst = sorted_fst.copy().arcsort('ilabel')
+        return fst.convert(sorted_fst, 'const')
+
+    def _prepared_cache_file(self) -> str:
+        """Cache path of the prepared model, keyed by the model and symbol files' contents and the options"""
+        digest = hashlib.sha1()
+        digest.update(f"v{self.PREPARE_VERSION};{self.config.get('type', 'plain')};"
+                      f"{sorted(self.prepare_options.items())!r};".encode('utf-8'))
+        for key in ('file', 'input_symbols', 'output_symbols'):
+            path = self.config.get(key)
+            if not path or not os.path.exists(path):
+                continue
+            digest.update(f"{key};".encode('utf-8'))
+            with open(path, 'rb') as f:
+                for block in iter(lambda: f.read(1 << 20), b''):
+                    digest.update(block)
+        stem = os.path.splitext(os.path.basename(self.config['file']))[0]
+        return os.path.join(self.prepare_cache_dir, f"{stem}.{digest.hexdigest()[:16]}.fst")
+
+    def _load_prepared(self, cache_file: str) -> bool:
+        """Load a previously prepared model; returns False if the cached file is unusable"""
+        try:
+            if self.FST_TYPE == 'const':
+                self.fst = self._read_const(cache_file)
+            else:
+                self.fst = pynini.Fst.read(cache_file)
+        except Exception as e:
+            _log.warning(f"Warning: ignoring unreadable prepared model {cache_file}: {str(e)}")
+            return False
+        self.base_fst = self.fst
+        _log.info(f"Loaded prepared model from cache: {cache_file}")
+        return True
+
+    def _prepare(self, cache_file: str):
+        """Optimize the loaded model for composition and cache the result.
+
+        Runs the enabled steps of rmepsilon, determinize, minimize and weight
+        pushing, then sorts the arcs on the input side, which composition
+        matches against.
+        """
+        options = self.prepare_options
+        start_time = time.time()
+        model_fst = self.base_fst
+        if not isinstance(model_fst, pynini.Fst):
+            model_fst = pynini.Fst.from_pywrapfst(model_fst)
+        else:
+            model_fst = model_fst.copy()
+        states, arcs = _lattice_size(model_fst)
+
+        if options['rmepsilon']:
+            model_fst.rmepsilon()
+        determinize = options['determinize']
+        if determinize == 'encode':
+            # Determinizing the (input, output, weight) acceptor keeps every path of
+            # an ambiguous transducer and always terminates
+            mapper = fst.EncodeMapper(model_fst.arc_type(), encode_labels=True, encode_weights=True)
+            model_fst.encode(mapper)
+            model_fst = pynini.determinize(model_fst)
+            if options['minimize']:
+                model_fst.minimize()
+            model_fst.decode(mapper)
+        elif determinize:
+            # 'disambiguate' keeps only the best output of each input string
+            model_fst = pynini.determinize(model_fst, det_type=determinize)
+            if options['minimize']:
+                model_fst.minimize()
+        elif options['minimize']:
+            _log.warning("Warning: minimize needs a determinized model; skipping it")
+        if options['push']:
+            model_fst = pynini.push(model_fst, push_weights=True, reweight_type='to_initial')
+        model_fst.arcsort('ilabel')
+        if self.FST_TYPE == 'const':
+            model_fst = fst.convert(model_fst, 'const')
+
+        prepared_states, prepared_arcs = _lattice_size(model_fst)
+        _log.info(f"Prepared model {self.config['file']}: {states} states, {arcs} arcs -> "
+                  f"{prepared_states} states, {prepared_arcs} arcs in {time.time() - start_time:.2f}s")
+        self.fst = self.base_fst = model_fst
+
+        try:
+            os.makedirs(self.prepare_cache_dir, exist_ok=True)
+            tmp_file = f"{cache_file}.tmp{os.getpid()}"
+            model_fst.write(tmp_file)
+            os.replace(tmp_file, cache_file)
+            _log.info(f"Cached prepared model: {cache_file}")
+        except Exception as e:
+            _log.warning(f"Warning: could not cache the prepared model in {self.prepare_cache_dir}: {str(e)}")
+
+    def relabel(self, input_symbols=None, output_symbols=None):
+        """Move the model onto the given label spaces, matching labels by symbol.
+
+        Symbols the target tables lack are added to them, so the tables passed
+        in may grow. The label pairs are kept on the model; a model whose
+        tables already agree is left untouched.
+        """
+        if input_symbols is not None:
+            self.relabel_ipairs = _relabel_pairs(self.base_fst.input_symbols(), input_symbols)
+        if output_symbols is not None:
+            self.relabel_opairs = _relabel_pairs(self.base_fst.output_symbols(), output_symbols)
+        if not self.relabel_ipairs and not self.relabel_opairs:
+            return False
+
+        self._mutable_base()
+        self.base_fst.relabel_pairs(ipairs=self.relabel_ipairs or None, opairs=self.relabel_opairs or None)
+        if input_symbols is not None:
+            self.base_fst.set_input_symbols(input_symbols)
+        if output_symbols is not None:
+            self.base_fst.set_output_symbols(output_symbols)
+        self.base_fst.arcsort('ilabel')
+        self.scaled_fsts = {}
+        self.csr = None
+        self.fst = self.base_fst
+        _log.info(f"Relabeled model {self.config.get('file')} "
+                  f"({len(self.relabel_ipairs)} input and {len(self.relabel_opairs)} output labels)")
+        return True
+
+    def scaled(self, weight: float):
+        """The FST with every arc and final weight multiplied by weight, built once per weight"""
+        if weight == 1.0:
+            return self.base_fst
+        scaled_fst = self.scaled_fsts.get(weight)
+        if scaled_fst is None:
+            base_fst = self.base_fst
+            if not isinstance(base_fst, pynini.Fst):
+                base_fst = pynini.Fst.from_pywrapfst(base_fst)
+            # In the tropical semiring, Power(w, k) is k * w
+            scaled_fst = pynini.arcmap(base_fst, map_type='power', power=weight)
+            self.scaled_fsts[weight] = scaled_fst
+        return scaled_fst
+
+    def apply_weight(self, weight: float):
+        """Decode with the model scaled by its log-linear weight"""
+        self.weight = weight
+        self.fst = self.scaled(weight)
+        self.csr = None
+
+    def compose(self, lattice, weight: float = None):
+        return _compose(lattice, self.fst if weight is None else self.scaled(weight))
+
+    def resolve_prepare(self, prepare) -> Optional[Dict]:
+        """Resolve a prepare setting, true or a mapping overriding single steps, to the steps to run"""
+        if not prepare:
+            return None
+        options = dict(self.PREPARE_DEFAULTS)
+        if isinstance(prepare, dict):
+            unknown = set(prepare) - set(options)
+            if unknown:
+                raise ConfigError(f"Unknown prepare options: {', '.join(sorted(unknown))}")
+            options.update(prepare)
+        if options['determinize'] is True:
+            options['determinize'] = self.PREPARE_DEFAULTS['determinize']
+        if options['determinize'] and options['determinize'] not in self.DETERMINIZE_TYPES:
+            raise ConfigError(f"Unknown determinize type: {options['determinize']} "
+                              f"(expected one of {', '.join(self.DETERMINIZE_TYPES)})")
+        return options
+
+    def prepare_search(self, search: str, options: Dict):
+        """Build the CSR arrays the viterbi search runs on"""
+        if search != 'viterbi':
+            super().prepare_search(search, options)
+        start_time = time.time()
+        csr = self.csr_model()
+        _log.info(f"Built CSR model with {csr.num_arcs()} arcs in {time.time() - start_time:.2f}s")
+
+    def search(self, labels: List[int], nbest: int):
+        """Viterbi search over the CSR arrays.
+
+        Only the 1-best path is searched, and a best path tied with another is
+        left to pynini, so the output stays identical to the composition's.
+        """
+        if nbest > 1:
+            return None
+        result = self.csr_model().viterbi(labels)
+        if result is None:
+            return []
+        olabels, cost, tied = result
+        return None if tied else [(olabels, cost)]
+
+    def label_symbols(self):
+        return self.base_fst.input_symbols(), self.base_fst.output_symbols()
+
+    def csr_model(self) -> 'CSRModel':
+        """CSR copy of the model, built once; taken from the bundle or the model's
+        converted arrays when they match the loaded model"""
+        if self.csr is not None:
+            return self.csr
+        entry = self.bundle_entry or {}
+        csr_dir = self.config.get('csr')
+        # The bundled arrays were built from the model scaled by the weight it was compiled with
+        if 'csr' in entry and entry.get('weight', 1.0) == self.weight:
+            self.csr = CSRModel.from_arrays(entry['csr'])
+        elif csr_dir and (self.weight == 1.0 and not self.relabel_ipairs and not self.relabel_opairs
+                          and not self.prepare_options):
+            # Converted arrays hold the unscaled, unprepared model in the label space it was converted with
+            self.csr = CSRModel.from_files(csr_dir, mmap=self.config.get('mmap', True))
+        else:
+            if csr_dir:
+                _log.warning(f"Warning: CSR arrays {csr_dir} do not match the weighted, relabeled or prepared "
+                             f"model; rebuilding them in memory")
+            self.csr = CSRModel.from_fst(self.fst)
+        return self.csr
+
+    def memory_stats(self) -> Dict[str, int]:
+        csr_dir = self.config.get('csr')
+        if not csr_dir or not self.config.get('mmap', True):
+            return {}
+        size, resident, shared = _mapped_memory(csr_dir)
+        return {'mapped_kb': size, 'mapped_resident_kb': resident, 'mapped_shared_kb': shared} if size else {}
+
+    def to_bundle_entry(self) -> Dict:
+        """Serialize the unscaled model, arc-sorted on the input side it is composed on.
+
+        Symbol tables equal to the decoder's are left out; the bundle carries
+        those once and load() attaches them again.
+        """
+        if not self.base_fst.properties(fst.I_LABEL_SORTED, True):
+            sorted_fst = self._mutable_base().arcsort('ilabel')
+            if self.weight == 1.0:
+                self.fst = sorted_fst
+        tables = {'input': self.base_fst.input_symbols(), 'output': self.base_fst.output_symbols()}
+        shared = [side for side, table in tables.items()
+                  if table is not None and self.symbol_tables.get(side) is not None
+                  and _same_symbols(table, self.symbol_tables[side])]
+        bundled_fst = self.base_fst
+        if shared:
+            bundled_fst = (self.base_fst.copy() if isinstance(self.base_fst, pynini.Fst)
+                           else pynini.Fst.from_pywrapfst(self.base_fst))
+            if 'input' in shared:
+                bundled_fst.set_input_symbols(None)
+            if 'output' in shared:
+                bundled_fst.set_output_symbols(None)
+        entry = {'fst': bundled_fst.write_to_string(), 'weight': self.weight, 'shared_symbols': shared}
+        if self.csr is not None:
+            # Only the viterbi search builds and reads the CSR arrays
+            entry['csr'] = self.csr.to_arrays()
+        return entry
+
+    def convert(self, directory: str) -> Dict:
+        """Write the model as a const FST, read without the mutable VectorFst copy.
+
+        An eagerly composed model becomes a const model; the CSR search keeps
+        its type. A model searched by the viterbi engine also gets its CSR
+        arrays, which are memory-mapped, so decoder processes on one machine
+        share them through the page cache.
+        """
+        model_config = dict(self.config)
+        stem = os.path.splitext(os.path.basename(self.config['file']))[0]
+        const_file = os.path.join(directory, f"{stem}.const.fst")
+        const_fst = self.const_fst()
+        const_fst.write(const_file)
+        if self.SEARCH == 'eager':
+            model_config['type'] = 'const'
+        # The written model is already prepared
+        model_config.update(file=const_file, prepare=False)
+        model_config.pop('csr', None)
+        model_config.pop('mmap', None)
+        converted = [const_file]
+        if self.csr is not None:
+            csr_dir = os.path.join(directory, f"{stem}.csr")
+            CSRModel.from_fst(const_fst).to_files(csr_dir)
+            model_config['csr'] = csr_dir
+            converted.append(csr_dir)
+        _log.info(f"Converted model {self.config['file']} to: {', '.join(converted)}")
+        return model_config
+
+    def verify(self):
+        """Verify the loaded FST meets basic requirements"""
+        if self.fst is None:
+            raise ConfigError("FST not loaded")
+        if self.fst.start() == -1:
+            raise ConfigError("FST has no start state")
+        if _num_states(self.fst) == 0:
+            raise ConfigError("FST has no states")
+        _log.debug(f"Model loaded successfully. Start state: {self.fst.start()}")
+        _log.debug(f"Num states: {_num_states(self.fst)}")
+        if _log.debug_enabled:
+            input_symbols, output_symbols = self.fst.input_symbols(), self.fst.output_symbols()
+            _log.debug(f"Input symbols: {input_symbols.num_symbols() if input_symbols else 'none'}")
+            _log.debug(f"Output symbols: {output_symbols.num_symbols() if output_symbols else 'none'}")
+        return True
+
+@register_model_type('const')
+class ConstFSTModel(FSTModel):
+    """FST model held as an immutable const FST, read without a mutable VectorFst copy"""
+
+    FST_TYPE = 'const'
+
+@register_model_type('csr')
+class CSRViterbiModel(FSTModel):
+    """FST model searched alone by Viterbi token passing over its CSR arrays"""
+
+    SEARCH = 'viterbi'
+
+class CSRModel:
+    """Array-backed (CSR) copy of a model FST, searched with Viterbi token passing.
+
+    The arcs of state s are ilabel[offsets[s]:offsets[s + 1]] (with the matching
+    olabel, weight and nextstate entries), sorted by input label so that input
+    epsilons come first and a label's arcs are found by binary search.
+    """
+
+    # Costs closer than this are treated as ties (pynini sums weights in float32)
+    TIE_DELTA = 1e-4
+
+    ARRAYS = ('offsets', 'ilabel', 'olabel', 'weight', 'nextstate', 'final')
+
+    def __init__(self, start, offsets, ilabel, olabel, weight, nextstate, final):
+        self.start = start
+        self.offsets = offsets
+        self.ilabel = ilabel
+        self.olabel = olabel
+        self.weight = weight
+        self.nextstate = nextstate
+        self.final = final
+
+        # The search walks list copies: indexing single NumPy elements from
+        # Python is several times slower than indexing a list. Memory-mapped
+        # arrays are walked through memoryviews instead, which index almost as
+        # fast and keep the page cache copy shared between processes.
+        self._offsets = _element_sequence(self.offsets)
+        self._ilabel = _element_sequence(self.ilabel)
+        self._olabel = _element_sequence(self.olabel)
+        self._weight = _element_sequence(self.weight)
+        self._nextstate = _element_sequence(self.nextstate)
+        self._final = _element_sequence(self.final)
+        # Input epsilons sort first, so a state has epsilon arcs iff its first arc has one;
+        # the epsilon closure only visits those states
+        np = _numpy()
+        first_arcs = self.offsets[:-1]
+        has_arcs = first_arcs < self.offsets[1:]
+        has_epsilons = np.zeros(len(first_arcs), dtype=bool)
+        has_epsilons[has_arcs] = self.ilabel[first_arcs[has_arcs]] == 0
+        self._has_epsilons = has_epsilons.tolist()
+        # Per visited state, its moves by input label (see _state_moves)
+        self._moves = [None] * len(self._final)
+        self._start_tokens = self._epsilon_closure({self.start: (0.0, None, False)})
+
+    @classmethod
+    def from_fst(cls, model_fst):
+        """Convert a loaded model FST into CSR arrays.
+
+        The arrays are read straight from the const FST binary, whose state
+        and arc records are fixed-size; other layouts are walked arc by arc.
+        """
+        np = _numpy()
+        const_fst = model_fst if model_fst.fst_type() == 'const' else fst.convert(model_fst, 'const')
+        data = const_fst.write_to_string()
+        fst_type, arc_type, flags, start, num_states, num_arcs, position = _fst_header(data, 0)
+        if fst_type != 'const' or arc_type not in ('standard', 'log') or flags & _FST_IS_ALIGNED:
+            return cls._from_fst_arcs(model_fst)
+
+        # State records: final weight, first arc, arcs, input and output epsilons
+        states = np.frombuffer(data, dtype=[('final', '<f4'), ('position', '<u4'), ('arcs', '<u4'),
+                                            ('ni', '<u4'), ('no', '<u4')],
+                               count=num_states, offset=position)
+        arcs = np.frombuffer(data, dtype=[('ilabel', '<i4'), ('olabel', '<i4'), ('weight', '<f4'),
+                                          ('nextstate', '<i4')],
+                             count=num_arcs, offset=position + states.nbytes)
+        # Sort each state's arcs like _from_fst_arcs: by input label, then the rest of the arc
+        arc_states = np.repeat(np.arange(num_states, dtype=np.int64), states['arcs'].astype(np.int64))
+        order = np.lexsort((arcs['nextstate'], arcs['weight'], arcs['olabel'], arcs['ilabel'], arc_states))
+        arcs = arcs[order]
+        offsets = np.zeros(num_states + 1, dtype=np.int64)
+        np.cumsum(states['arcs'], out=offsets[1:])
+        return cls(start, offsets, arcs['ilabel'].copy(), arcs['olabel'].copy(), arcs['weight'].copy(),
+                   arcs['nextstate'].copy(), states['final'].astype(np.float64))
+
+    @classmethod
+    def _from_fst_arcs(cls, model_fst):
+        """Convert a model FST into CSR arrays by walking its arcs"""
+        np = _numpy()
+        num_states = _num_states(model_fst)
+        offsets = np.zeros(num_states + 1, dtype=np.int64)
+        final = np.full(num_states, np.inf, dtype=np.float64)
+        ilabels, olabels, weights, nextstates = [], [], [], []
+
+        for state in range(num_states):
+            arcs = sorted((arc.ilabel, arc.olabel, float(arc.weight), arc.nextstate)
+                          for arc in model_fst.arcs(state))
+            for ilabel, olabel, weight, nextstate in arcs:
+                ilabels.append(ilabel)
+                olabels.append(olabel)
+                weights.append(weight)
+                nextstates.append(nextstate)
+            offsets[state + 1] = len(ilabels)
+            final[state] = float(model_fst.final(state))
+
+        return cls(model_fst.start(), offsets,
+                   np.array(ilabels, dtype=np.int32),
+                   np.array(olabels, dtype=np.int32),
+                   np.array(weights, dtype=np.float32),
+                   np.array(nextstates, dtype=np.int32),
+                   final)
+
+    @classmethod
+    def from_arrays(cls, arrays: Dict):
+        """Rebuild a CSR model from to_arrays() output"""
+        np = _numpy()
+        return cls(arrays['start'], *(np.frombuffer(arrays[name][1], dtype=arrays[name][0])
+                                      for name in cls.ARRAYS))
+
+    @classmethod
+    def from_files(cls, directory: str, mmap: bool = True):
+        """Load CSR arrays written by to_files(), memory-mapping them unless mmap is False"""
+        np = _numpy()
+        mmap_mode = 'r' if mmap else None
+        try:
+            start = int(np.load(os.path.join(directory, 'start.npy')))
+            return cls(start, *(np.load(os.path.join(directory, f"{name}.npy"), mmap_mode=mmap_mode)
+                                for name in cls.ARRAYS))
+        except OSError as e:
+            raise ConfigError(f"Failed to load CSR arrays from {directory}: {str(e)}")
+
+    def to_files(self, directory: str):
+        """Write the arrays as .npy files that from_files() can memory-map"""
+        np = _numpy()
+        os.makedirs(directory, exist_ok=True)
+        np.save(os.path.join(directory, 'start.npy'), np.array(self.start, dtype=np.int64))
+        for name in self.ARRAYS:
+            np.save(os.path.join(directory, f"{name}.npy"), np.ascontiguousarray(getattr(self, name)))
+
+    def to_arrays(self) -> Dict:
+        """Raw (dtype, bytes) arrays, so that unpickling them does not need numpy"""
+        arrays = {'start': self.start}
+        for name in self.ARRAYS:
+            array = getattr(self, name)
+            arrays[name] = (array.dtype.str, array.tobytes())
+        return arrays
+
+    def num_arcs(self) -> int:
+        return len(self._ilabel)
+
+    def viterbi(self, labels: List[int]) -> Optional[Tuple[List[int], float, bool]]:
+        """Find the best path for an input label sequence.
+
+        Returns (output labels, cost, tied) or None when no path accepts the
+        input. tied is True when another path has the same cost, in which case
+        the choice between them may differ from pynini.shortestpath.
+        """
+        # Tokens map a model state to (cost, backpointer, tied); backpointers
+        # are (previous backpointer, output labels) pairs, skipping moves
+        # without output. Each move already includes its epsilon closure, so
+        # one step per input label is a single pass over the tokens.
+        moves_of = self._moves
+        delta = self.TIE_DELTA
+        tokens = self._start_tokens
+
+        for label in labels:
+            next_tokens = {}
+            for state, (cost, backpointer, tied) in tokens.items():
+                moves = moves_of[state]
+                if moves is None:
+                    moves = self._state_moves(state)
+                for target, move_cost, olabels, move_tied in moves.get(label, ()):
+                    target_cost = cost + move_cost
+                    token = next_tokens.get(target)
+                    if token is None or target_cost < token[0] - delta:
+                        next_tokens[target] = (target_cost, (backpointer, olabels) if olabels else backpointer,
+                                               tied or move_tied)
+                    elif target_cost <= token[0] + delta and not token[2]:
+                        next_tokens[target] = (min(target_cost, token[0]), token[1], True)
+            if not next_tokens:
+                return None
+            tokens = next_tokens
+
+        best = None
+        for state, (cost, backpointer, tied) in tokens.items():
+            total = cost + self._final[state]
+            if total == float('inf'):
+                continue
+            if best is None or total < best[1] - delta:
+                best = (backpointer, total, tied)
+            elif total <= best[1] + delta:
+                best = (best[0], min(best[1], total), True)
+        if best is None:
+            return None
+
+        backpointer, cost, tied = best
+        chunks = []
+        while backpointer is not None:
+            backpointer, olabels = backpointer
+            chunks.append(olabels)
+        return [olabel for olabels in reversed(chunks) for olabel in olabels], cost, tied
+
+    def _state_moves(self, state) -> Dict[int, List[Tuple[int, float, Tuple[int, ...], bool]]]:
+        """Moves out of a state by input label, built on the state's first visit.
+
+        A move reads the label and then follows input epsilons: it is a
+        (target, cost, output labels, tied) entry of the label's closure.
+        """
+        offsets, ilabel, olabel = self._offsets, self._ilabel, self._olabel
+        weight, nextstate = self._weight, self._nextstate
+        delta = self.TIE_DELTA
+        moves = {}
+        i, hi = offsets[state], offsets[state + 1]
+        while i < hi:
+            label = ilabel[i]
+            tokens = {}
+            while i < hi and ilabel[i] == label:
+                target = nextstate[i]
+                token = tokens.get(target)
+                if token is None or weight[i] < token[0] - delta:
+                    tokens[target] = (weight[i], (None, olabel[i]) if olabel[i] else None, False)
+                elif weight[i] <= token[0] + delta and not token[2]:
+                    tokens[target] = (min(weight[i], token[0]), token[1], True)
+                i += 1
+            if label == 0:
+                continue
+            label_moves = []
+            for target, (cost, backpointer, tied) in self._epsilon_closure(tokens).items():
+                olabels = []
+                while backpointer is not None:
+                    backpointer, out = backpointer
+                    olabels.append(out)
+                label_moves.append((target, cost, tuple(reversed(olabels)), tied))
+            moves[label] = label_moves
+        self._moves[state] = moves
+        return moves
+
+    def _epsilon_closure(self, tokens):
+        """Follow input-epsilon arcs from every token"""
+        has_epsilons = self._has_epsilons
+        queue = [state for state in tokens if has_epsilons[state]]
+        if not queue:
+            return tokens
+        offsets, ilabel, olabel = self._offsets, self._ilabel, self._olabel
+        weight, nextstate = self._weight, self._nextstate
+        delta = self.TIE_DELTA
+        while queue:
+            state = queue.pop()
+            cost, backpointer, tied = tokens[state]
+            i, hi = offsets[state], offsets[state + 1]
+            while i < hi and ilabel[i] == 0:
+                target = nextstate[i]
+                target_cost = cost + weight[i]
+                token = tokens.get(target)
+                if token is None or target_cost < token[0] - delta:
+                    tokens[target] = (target_cost, (backpointer, olabel[i]) if olabel[i] else backpointer, tied)
+                    if has_epsilons[target]:
+                        queue.append(target)
+                elif target_cost <= token[0] + delta and not token[2]:
+                    tokens[target] = (min(target_cost, token[0]), token[1], True)
+                    if has_epsilons[target]:
+                        queue.append(target)
+                i += 1
+        return tokens
+
+@register_model_type('trie')
+class TrieModel(Model):
+    """Word segmentation model searched with dynamic programming over a word trie.
+
+    This is the char-to-word lexicon built by script/mk_lexicon.py without the
+    FST: every vocabulary word costs word_cost (or the cost in an optional
+    second column of the vocabulary file) and the best segmentation of the
+    character sequence is found directly, without composition.
+    """
+
+    SEARCH = 'trie'
+    SEARCH_INPUT = 'tokens'
+
+    def __init__(self, config, symbol_tables=None, bundle_entry=None):
+        super().__init__(config, symbol_tables, bundle_entry)
+        # Trie arrays: the children of node n are child_label/child_node[child_offsets[n]:child_offsets[n + 1]],
+        # sorted by character code; word_label[n] is the output label of the word ending at n (-1 if none).
+        # Typed arrays take a fraction of the memory of lists of Python ints and floats
+        self.child_offsets = array('i')
+        self.child_label = array('i')
+        self.child_node = array('i')
+        self.word_label = array('i')
+        self.word_cost = array('f')
+        self.base_word_cost = self.word_cost
+
+    def load(self):
+        """Build the trie from the vocabulary file"""
+        if self.bundle_entry is not None:
+            (self.child_offsets, self.child_label, self.child_node,
+             self.word_label, self.word_cost) = self.bundle_entry['trie']
+            self.base_word_cost = self.word_cost
+            _log.info(f"Loaded trie from bundle with {len(self.word_label)} nodes")
+            return
+
+        vocab_file = self.config.get('vocab')
+        if not vocab_file:
+            raise ConfigError("No vocabulary file specified for trie model")
+        if not os.path.exists(vocab_file):
+            raise ConfigError(f"Vocabulary file not found: {vocab_file}")
+
+        output_sym = self.symbol_tables.get('output')
+        output_sym_path = self.config.get('output_symbols')
+        if output_sym_path:
+            if not os.path.exists(output_sym_path):
+                raise ConfigError(f"Output symbol table not found: {output_sym_path}")
+            output_sym = self._read_symbols(output_sym_path)
+        if output_sym is None:
+            raise ConfigError("Trie model needs an output symbol table")
+
+        default_cost = float(self.config.get('word_cost', 1.0))
+        _log.info(f"Building word trie from: {vocab_file}")
+
+        words = []
+        with open(vocab_file, 'r', encoding='utf-8') as f:
+            for line in f:
+                fields = line.split()
+                if not fields:
+                    continue
+                label = output_sym.find(fields[0])
+                if label == -1:
+                    _log.warning(f"Warning: word not in output symbol table: {fields[0]}")
+                    continue
+                cost = float(fields[1]) if len(fields) > 1 else default_cost
+                words.append((fields[0], label, cost))
+        # Sorted words sharing a prefix are contiguous, in character code order; the
+        # sort is stable, so a word listed twice keeps its last entry below
+        words.sort(key=lambda entry: entry[0])
+
+        # Flatten the trie breadth first straight into the arrays: each node is
+        # the range of words sharing its prefix of length depth
+        self.child_offsets.append(0)
+        ranges = deque([(0, len(words), 0)])
+        num_nodes = 1
+        while ranges:
+            start, end, depth = ranges.popleft()
+            label, cost = -1, 0.0
+            while start < end and len(words[start][0]) == depth:
+                _, label, cost = words[start]
+                start += 1
+            self.word_label.append(label)
+            self.word_cost.append(cost)
+            while start < end:
+                char = words[start][0][depth]
+                child_end = start + 1
+                while child_end < end and words[child_end][0][depth] == char:
+                    child_end += 1
+                self.child_label.append(ord(char))
+                self.child_node.append(num_nodes)
+                ranges.append((start, child_end, depth + 1))
+                num_nodes += 1
+                start = child_end
+            self.child_offsets.append(len(self.child_label))
+
+        _log.info(f"Successfully built trie with {len(words)} words and {num_nodes} nodes")
+
+    def apply_weight(self, weight: float):
+        """Scale the word costs by the model's log-linear weight"""
+        self.weight = weight
+        self.word_cost = (self.base_word_cost if weight == 1.0
+                          else array('f', (cost * weight for cost in self.base_word_cost)))
+
+    def to_bundle_entry(self) -> Dict:
+        return {'trie': (self.child_offsets, self.child_label, self.child_node,
+                         self.word_label, self.base_word_cost)}
+
+    def verify(self):
+        """Verify the trie was built"""
+        if not self.word_label:
+            raise ConfigError("Trie not loaded")
+        if len(self.child_label) == 0:
+            raise ConfigError("Trie has no words")
+        return True
+
+    def prepare_search(self, search: str, options: Dict):
+        """The trie needs nothing built, only a search it can run"""
+        if search != 'trie':
+            super().prepare_search(search, options)
+        if options['nbest'] > 1:
+            raise ConfigError("The trie model only produces the 1-best segmentation")
+        if options['input_format'] in ('ids', 'ids-bin'):
+            raise ConfigError("The trie model segments characters and cannot read ids input")
+
+    def search(self, tokens: List[str], nbest: int) -> List[Tuple[List[int], float]]:
+        """Find the lowest cost segmentation of a character sequence.
+
+        Returns [(output labels, cost)], or no hypothesis if the sequence cannot
+        be covered by vocabulary words.
+        """
+        chars = [ord(token) if len(token) == 1 else -1 for token in tokens]
+        length = len(chars)
+        child_offsets, child_label, child_node = self.child_offsets, self.child_label, self.child_node
+        word_label, word_cost = self.word_label, self.word_cost
+
+        inf = float('inf')
+        best = [inf] * (length + 1)
+        back = [None] * (length + 1)
+        best[0] = 0.0
+        for start in range(length):
+            if best[start] == inf:
+                continue
+            node = 0
+            for end in range(start, length):
+                lo, hi = child_offsets[node], child_offsets[node + 1]
+                i = bisect_left(child_label, chars[end], lo, hi)
+                if i == hi or child_label[i] != chars[end]:
+                    break
+                node = child_node[i]
+                if word_label[node] != -1:
+                    cost = best[start] + word_cost[node]
+                    # Strict comparison keeps the segmentation found first,
+                    # i.e. the one with the earlier word boundary
+                    if cost < best[end + 1]:
+                        best[end + 1] = cost
+                        back[end + 1] = (start, word_label[node])
+
+        if best[length] == inf:
+            return []
+        olabels = []
+        position = length
+        while position > 0:
+            position, label = back[position]
+            olabels.append(label)
+        olabels.reverse()
+        return [(olabels, best[length])]
+
+class ResultCache:
+    """Bounded LRU cache of decoding results keyed on (fingerprint, tokens)"""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+
+    def get(self, key):
+        hypotheses = self.entries.get(key)
+        if hypotheses is not None:
+            self.entries.move_to_end(key)
+        return hypotheses
+
+    def put(self, key, hypotheses):
+        self.entries[key] = hypotheses
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def load(self, cache_file: str, fingerprint: str) -> int:
+        """Load entries saved for the same fingerprint, returning how many were loaded"""
+        try:
+            with open(cache_file, 'rb') as f:
+                entries = pickle.load(f)
+        except Exception as e:
+            _log.warning(f"Warning: could not read cache file {cache_file}: {str(e)}")
+            return 0
+        loaded = 0
+        for key, hypotheses in entries:
+            if key[0] == fingerprint:
+                self.put(key, hypotheses)
+                loaded += 1
+        return loaded
+
+    def save(self, cache_file: str):
+        """Write the entries in LRU order, replacing the file atomically"""
+        tmp_file = f"{cache_file}.tmp{os.getpid()}"
+        with open(tmp_file, 'wb') as f:
+            pickle.dump(list(self.entries.items()), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_file, cache_file)
+
+class StageProfiler:
+    """Per-stage wall/CPU time, per-sentence latency and lattice size collector"""
+
+    def __init__(self):
+        self.stages = {}      # name -> [calls, wall seconds, cpu seconds]
+        self.latencies = []   # per-sentence wall seconds
+        self.lattices = {}    # name -> [(states, arcs), ...]
+
+    @contextmanager
+    def stage(self, name: str):
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            totals = self.stages.setdefault(name, [0, 0.0, 0.0])
+            totals[0] += 1
+            totals[1] += time.perf_counter() - wall
+            totals[2] += time.process_time() - cpu
+
+    def sentence(self, seconds: float):
+        self.latencies.append(seconds)
+
+    def lattice(self, name: str, lattice):
+        self.lattices.setdefault(name, []).append(_lattice_size(lattice))
+
+    def merge(self, other: 'StageProfiler'):
+        """Add the measurements of another profiler (e.g. from a worker process)"""
+        for name, (calls, wall, cpu) in other.stages.items():
+            totals = self.stages.setdefault(name, [0, 0.0, 0.0])
+            totals[0] += calls
+            totals[1] += wall
+            totals[2] += cpu
+        self.latencies.extend(other.latencies)
+        for name, sizes in other.lattices.items():
+            self.lattices.setdefault(name, []).extend(sizes)
+
+    def report(self) -> Dict:
+        latencies = sorted(self.latencies)
+        report = {
+            'sentences': len(latencies),
+            'latency_ms': {
+                'mean': 1000.0 * sum(latencies) / len(latencies) if latencies else 0.0,
+                'p50': 1000.0 * _percentile(latencies, 50),
+                'p95': 1000.0 * _percentile(latencies, 95),
+                'p99': 1000.0 * _percentile(latencies, 99),
+                'max': 1000.0 * latencies[-1] if latencies else 0.0,
+            },
+            'stages': {name: {'calls': calls, 'wall_s': wall, 'cpu_s': cpu,
+                              'mean_ms': 1000.0 * wall / calls if calls else 0.0}
+                       for name, (calls, wall, cpu) in sorted(self.stages.items(), key=lambda item: -item[1][1])},
+            'lattices': {},
+        }
+        for name, sizes in self.lattices.items():
+            states = sorted(size[0] for size in sizes)
+            arcs = sorted(size[1] for size in sizes)
+            report['lattices'][name] = {
+                'count': len(sizes),
+                'states': {'mean': sum(states) / len(states), 'p50': _percentile(states, 50),
+                           'p95': _percentile(states, 95), 'max': states[-1]},
+                'arcs': {'mean': sum(arcs) / len(arcs), 'p50': _percentile(arcs, 50),
+                         'p95': _percentile(arcs, 95), 'max': arcs[-1]},
+            }
+        return report
+
+    def write(self, profile_file: str) -> Dict:
+        report = self.report()
+        with open(profile_file, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+            f.write("\n")
+        return report
+
+class OutputBuffer:
+    """Collects output lines (or binary records) and writes them to a stream in blocks"""
+
+    def __init__(self, stream, block_lines: int = 256, binary: bool = False):
+        self.binary = binary
+        self.stream = getattr(stream, 'buffer', stream) if binary else stream
+        # Interactive output is written line by line
+        isatty = getattr(stream, 'isatty', None)
+        self.block_lines = 1 if isatty is not None and isatty() else block_lines
+        self.lines = []
+
+    def write_line(self, line):
+        self.lines.append(line)
+        if len(self.lines) >= self.block_lines:
+            self.flush()
+
+    def flush(self):
+        if self.lines:
+            if self.binary:
+                self.stream.write(b"".join(self.lines))
+            else:
+                self.stream.write("\n".join(self.lines))
+                self.stream.write("\n")
+            self.lines = []
+        self.stream.flush()
+
+class DecoderConfig:
+    def __init__(self, config_file: str = None, args: Dict = None):
+        self.config = {
+            'input_format': 'text',
+            'output_format': 'text',
+            'nbest': 1,
+            'beam_width': 0,
+            'trim_width': 0.0,
+            'print_duplicates': False,
+            'print_input': False,
+            'print_all': False,
+            'sample': False,
+            'negative_probs': False,
+            'weights': None,
+            'input_symbols': None,
+            'output_symbols': None,
+            'unknown_symbol': '<unk>',
+            'terminal_symbol': '</s>',
+            'show_id': False,
+            'engine': 'pynini',
+            'input_file': None,
+            'cache_size': 0,
+            'cache_file': None,
+            'jobs': 1,
+            'chunk_size': 256,
+            'split': False,
+            'split_symbols': list(MYANMAR_PUNCTUATION),
+            'split_whitespace': True,
+            'split_min_tokens': 0,
+            'serve': None,
+            'batch_window_ms': 5.0,
+            'max_batch': 64,
+            'compile_bundle': None,
+            'convert_models': None,
+            'prepare': None,
+            'prepare_cache_dir': None,
+            'profile': None,
+            'log_level': 'info',
+            'log_format': 'text',
+            'log_file': None,
+            'log_sample': 0.0,
+            'tune': None,
+            'tune_grid': None,
+            'models': []
+        }
+        
+        self.symbol_tables = {'input': None, 'output': None}
+        # Label maps: input token -> label, and output label -> symbol (None for unused ids)
+        self.input_labels = {}
+        self.output_words = []
+        self.unknown_id = -1
+        self.terminal_id = -1
+        self.bundle = None
+        self.bundle_file = None
+        
+        if config_file:
+            self.load(config_file)
+        if args:
+            self._apply_args(args)  # Changed from apply_args to _apply_args
+    
+    def load(self, config_file: str):
+        if _is_bundle(config_file):
+            return self._load_bundle(config_file)
+
+        try:
+            # Only YAML configs need yaml; bundles load without importing it
+            import yaml
+            with open(config_file, 'r') as f:
+                config_data = yaml.safe_load(f) or {}
+            
+            for key, value in config_data.items():
+                if key in self.config:
+                    self.config[key] = value
+            
+            # Load symbol tables with verification
+            if self.config['input_symbols']:
+                self.symbol_tables['input'] = fst.SymbolTable.read_text(self.config['input_symbols'])
+                if self.config['unknown_symbol']:
+                    self.unknown_id = self.symbol_tables['input'].find(self.config['unknown_symbol'])
+                if self.config['terminal_symbol']:
+                    self.terminal_id = self.symbol_tables['input'].find(self.config['terminal_symbol'])
+            
+            if self.config['output_symbols']:
+                self.symbol_tables['output'] = fst.SymbolTable.read_text(self.config['output_symbols'])
+
+            self._build_label_maps()
+                
+        except Exception as e:
+            raise ConfigError(f"Config loading error: {str(e)}")
+
+    def _load_bundle(self, bundle_file: str):
+        """Load the resolved config, symbol tables and label maps from a compiled bundle"""
+        try:
+            with open(bundle_file, 'rb') as f:
+                f.read(len(BUNDLE_MAGIC))
+                bundle = pickle.load(f)
+            if bundle.get('version') != BUNDLE_VERSION:
+                raise ConfigError(f"Unsupported bundle version: {bundle.get('version')}")
+
+            self.config.update(bundle['config'])
+            # The symbol tables travel embedded in an empty FST
+            carrier = pynini.Fst.read_from_string(bundle['symbols'])
+            if carrier.input_symbols() is not None:
+                self.symbol_tables['input'] = carrier.input_symbols().copy()
+                if self.config['unknown_symbol']:
+                    self.unknown_id = self.symbol_tables['input'].find(self.config['unknown_symbol'])
+                if self.config['terminal_symbol']:
+                    self.terminal_id = self.symbol_tables['input'].find(self.config['terminal_symbol'])
+            if carrier.output_symbols() is not None:
+                self.symbol_tables['output'] = carrier.output_symbols().copy()
+
+            self.input_labels, self.output_words = bundle['labels']
+            self.bundle = bundle
+            self.bundle_file = bundle_file
+            _log.info(f"Loaded bundle: {bundle_file}")
+
+        except ConfigError:
+            raise
+        except Exception as e:
+            raise ConfigError(f"Bundle loading error: {str(e)}")
+
+    def _build_label_maps(self):
+        """Build Python label maps from the symbol tables"""
+        if self.symbol_tables['input'] is not None:
+            self.input_labels = {symbol: key for key, symbol in self.symbol_tables['input']}
+        if self.symbol_tables['output'] is not None:
+            output_sym = self.symbol_tables['output']
+            self.output_words = [None] * output_sym.available_key()
+            for key, symbol in output_sym:
+                self.output_words[key] = symbol
+
+    def model_weights(self) -> List[float]:
+        """Log-linear weight of each model: the top-level weights list when set, else the model's own"""
+        weights = []
+        for index, model_config in enumerate(self.config['models']):
+            if self.config['weights'] and index < len(self.config['weights']):
+                weight = self.config['weights'][index]
+            else:
+                weight = model_config.get('weights', [1.0])
+                if isinstance(weight, list):
+                    weight = weight[0] if weight else 1.0
+            weights.append(float(weight))
+        return weights
+
+    def symbols_bundle_entry(self) -> bytes:
+        """Serialize the decoder symbol tables by embedding them in an empty FST"""
+        carrier = pynini.Fst()
+        if self.symbol_tables['input'] is not None:
+            carrier.set_input_symbols(self.symbol_tables['input'])
+        if self.symbol_tables['output'] is not None:
+            carrier.set_output_symbols(self.symbol_tables['output'])
+        return carrier.write_to_string()
+    
+    def _apply_args(self, args: Dict):
+        """Apply command-line arguments to configuration"""
+        for key, value in args.items():
+            if value is not None and key in self.config:
+                # Handle special cases
+                if key == 'weights':
+                    self.config[key] = [float(w) for w in value.split(',')]
+                elif key == 'split_symbols':
+                    self.config[key] = [symbol for symbol in value.split(',') if symbol]
+                elif key in ['nbest', 'beam_width', 'jobs', 'chunk_size', 'cache_size', 'max_batch', 'split_min_tokens']:
+                    self.config[key] = int(value)
+                elif key in ['trim_width', 'batch_window_ms', 'log_sample']:
+                    self.config[key] = float(value)
+                elif key in ['print_input', 'print_all', 'sample', 'negative_probs', 'print_duplicates', 'split',
+                             'prepare']:
+                    self.config[key] = bool(value)
+                elif key == 'show_id':
+                    self.config[key] = bool(value)
+                else:
+                    self.config[key] = value
+
+class Decoder:
+    def __init__(self, config: DecoderConfig):
+        self.config = config
+        self.sentence_id = 0
+        self.multiplier = -1 if config.config['negative_probs'] else 1
+        self.unknown_words = []
+        self.stats = Counter()
+        self.profiler = StageProfiler() if config.config['profile'] else None
+        
+        # Initialize models with verification
+        self.models = []
+        # Resident anonymous (private) memory each model took to load, in KiB; only
+        # measured when the report is logged
+        self.model_memory = []
+        measure_memory = _log.level <= DecoderLog.LEVELS['info']
+
+        bundle_entries = self.config.bundle['models'] if self.config.bundle else None
+        for index, model_config in enumerate(self.config.config['models']):
+            try:
+                _log.debug(f"Initializing model with config: {model_config}")
+                bundle_entry = bundle_entries[index] if bundle_entries else None
+                model_type = model_config.get('type', 'plain')
+                if model_type not in MODEL_TYPES:
+                    raise ConfigError(f"Unknown model type: {model_type} "
+                                      f"(expected one of {', '.join(MODEL_TYPES)})")
+                model = MODEL_TYPES[model_type](model_config, self.config.symbol_tables, bundle_entry)
+                _log.debug("Model object created, attempting to load...")
+                if bundle_entry is None:
+                    # A model's own prepare setting overrides the global one
+                    prepare = model_config.get('prepare', self.config.config['prepare'])
+                    model.prepare_options = model.resolve_prepare(prepare)
+                    model.prepare_cache_dir = self._prepare_cache_dir()
+                memory_before = _memory_status() if measure_memory else None
+                model.load()
+                memory_after = _memory_status() if measure_memory else None
+                if memory_before and memory_after:
+                    self.model_memory.append(memory_after.get('RssAnon', 0) - memory_before.get('RssAnon', 0))
+                model.verify()
+                self.models.append(model)
+            except Exception as e:
+                raise DecoderError(f"Model initialization failed: {str(e)}")
+
+        self._reconcile_symbols()
+
+        # Scale each model by its log-linear weight once, here, rather than per sentence
+        for model, weight in zip(self.models, self.config.model_weights()):
+            model.apply_weight(weight)
+            if weight != 1.0:
+                _log.info(f"Scaled model weights by {weight:g}")
+
+        # Integer label input: tokens are already labels of the input symbol table
+        self.ids_input = self.config.config['input_format'] in ('ids', 'ids-bin')
+
+        # The cascade search follows the model types; the engine can force the viterbi search
+        engine = self.config.config['engine']
+        if engine not in ('pynini', 'viterbi'):
+            raise ConfigError(f"Unknown engine: {engine}")
+        searches = sorted({model.SEARCH for model in self.models} - {'eager'})
+        if engine == 'viterbi':
+            searches = ['viterbi']
+        # The model searched a whole sentence at a time, if any, and its search
+        self.search_model = None
+        self.search = None
+        if searches:
+            if len(self.models) != 1:
+                raise ConfigError(f"The {searches[0]} search supports exactly one model")
+            self.search_model, self.search = self.models[0], searches[0]
+            self.search_model.prepare_search(self.search, self.config.config)
+
+        # Segment splitting: boundary token -> output label (or the symbol itself when the
+        # output table lacks it and the output is text)
+        self.split_boundaries = None
+        if self.config.config['split']:
+            self.split_boundaries = self._split_boundaries()
+            _log.info(f"Splitting lines at {' '.join(self.config.config['split_symbols']) or 'no symbols'}"
+                      f"{' and whitespace runs' if self.config.config['split_whitespace'] else ''}")
+
+        self._report_model_memory()
+
+        self.cache = None
+        self.cache_journal = None
+        self.fingerprint = self._fingerprint()
+        if self.config.config['cache_size'] > 0:
+            self.cache = ResultCache(self.config.config['cache_size'])
+            cache_file = self.config.config['cache_file']
+            if cache_file and os.path.exists(cache_file):
+                loaded = self.cache.load(cache_file, self.fingerprint)
+                _log.info(f"Loaded {loaded} cached results from: {cache_file}")
+
+    def _prepare_cache_dir(self) -> str:
+        """Directory of prepared models: prepare_cache_dir, else the user cache directory"""
+        cache_dir = self.config.config['prepare_cache_dir']
+        if cache_dir:
+            return cache_dir
+        cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+        return os.path.join(cache_home, 'fst_decoder', 'prepared')
+
+    def _reconcile_symbols(self):
+        """Put every model with its own labels on the label space of its neighbours, once at load.
+
+        The first model's input side follows the decoder's input table, each
+        following model's input side follows the output table of the model
+        before it, and the last model's output side follows the decoder's
+        output table. Decoding then needs no per-sentence symbol checks.
+        """
+        labeled_models = [model for model in self.models if model.label_symbols() is not None]
+        if not labeled_models or self.config.bundle:
+            # A bundle's models were reconciled when it was compiled
+            return
+        input_symbols = self.config.symbol_tables['input']
+        output_symbols = self.config.symbol_tables['output']
+        extended = False
+        for index, model in enumerate(labeled_models):
+            if any(table is None for table in model.label_symbols()):
+                _log.warning(f"Warning: model {model.config.get('file')} has no symbol tables; "
+                             f"its labels are used as they are")
+                input_symbols = None
+                continue
+            target_input = input_symbols
+            target_output = output_symbols if index == len(labeled_models) - 1 else None
+            input_size = target_input.num_symbols() if target_input is not None else 0
+            output_size = target_output.num_symbols() if target_output is not None else 0
+            model.relabel(target_input, target_output)
+            extended |= ((index == 0 and target_input is not None and target_input.num_symbols() != input_size) or
+                         (target_output is not None and target_output.num_symbols() != output_size))
+            input_symbols = model.label_symbols()[1]
+
+        if extended:
+            # Symbols only the models know were added to the decoder tables
+            self.config._build_label_maps()
+
+    def _split_boundaries(self) -> Dict:
+        """Map each boundary token to the output label it is written back as"""
+        output_sym = self.config.symbol_tables['output']
+        text_output = self.config.config['output_format'] not in ('ids', 'ids-bin')
+        unknown_olabel = output_sym.find(self.config.config['unknown_symbol']) if output_sym else -1
+        boundaries = {}
+        for symbol in self.config.config['split_symbols']:
+            olabel = output_sym.find(symbol) if output_sym else -1
+            if olabel == -1:
+                olabel = symbol if text_output else max(unknown_olabel, 0)
+            if not self.ids_input:
+                boundaries[symbol] = olabel
+                continue
+            # ids input carries the boundary as its input label
+            label = self.config.input_labels.get(symbol)
+            if label is not None:
+                boundaries[str(label)] = olabel
+                boundaries[label] = olabel
+        return boundaries
+
+    def _report_model_memory(self):
+        """Log the private memory each model took to load and the residency of its mapped arrays"""
+        if len(self.model_memory) != len(self.models):
+            return
+        for model, private in zip(self.models, self.model_memory):
+            name = model.config.get('file', model.config.get('vocab'))
+            message = f"Model {name} ({model.config.get('type', 'plain')}): {private / 1024.0:.1f} MB private"
+            stats = model.memory_stats()
+            if stats:
+                message += (f", {stats['mapped_kb'] / 1024.0:.1f} MB of mapped CSR arrays "
+                            f"({stats['mapped_resident_kb'] / 1024.0:.1f} MB resident, "
+                            f"{stats['mapped_shared_kb'] / 1024.0:.1f} MB shared)")
+            _log.info(message, event='model_memory', model=name, private_kb=private, **stats)
+
+    def convert_models(self, directory: str):
+        """Write each model in its fastest-loading form, and a config that loads them.
+
+        FST models become const FSTs, read without the mutable VectorFst copy;
+        the model searched by the viterbi engine also gets its memory-mapped
+        CSR arrays. The models are written unscaled, with their reconciled
+        symbol tables.
+        """
+        os.makedirs(directory, exist_ok=True)
+        models_config = [model.convert(directory) for model in self.models]
+
+        config = dict(self.config.config)
+        for key in RUN_OPTIONS:
+            config.pop(key, None)
+        config['models'] = models_config
+        config['prepare'] = None
+        config_file = os.path.join(directory, 'config.yaml')
+        import yaml
+        with open(config_file, 'w', encoding='utf-8') as f:
+            yaml.safe_dump(config, f, allow_unicode=True, sort_keys=False)
+        _log.info(f"Wrote converted config to: {config_file}")
+
+    def write_bundle(self, bundle_file: str):
+        """Write the loaded models, symbol tables, label maps and resolved config to one file"""
+        entries = [model.to_bundle_entry() for model in self.models]
+
+        config = dict(self.config.config)
+        for key in BUNDLE_RUNTIME_OPTIONS:
+            config.pop(key, None)
+        bundle = {
+            'version': BUNDLE_VERSION,
+            'config': config,
+            'symbols': self.config.symbols_bundle_entry(),
+            'labels': (self.config.input_labels, self.config.output_words),
+            'models': entries,
+        }
+
+        tmp_file = f"{bundle_file}.tmp{os.getpid()}"
+        with open(tmp_file, 'wb') as f:
+            f.write(BUNDLE_MAGIC)
+            pickle.dump(bundle, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_file, bundle_file)
+        _log.info(f"Wrote bundle with {len(entries)} models to: {bundle_file}")
+
+    def _fingerprint(self) -> str:
+        """Hash of the model files and the options that change decoding results"""
+        digest = hashlib.sha1()
+        if self.config.bundle_file:
+            file_stat = os.stat(self.config.bundle_file)
+            digest.update(f"bundle:{file_stat.st_size}:{file_stat.st_mtime_ns};".encode('utf-8'))
+        for model_config in self.config.config['models']:
+            for key in sorted(model_config):
+                value = model_config[key]
+                digest.update(f"{key}={value!r};".encode('utf-8'))
+                if key in RESULT_FILE_KEYS and isinstance(value, str) and os.path.exists(value):
+                    file_stat = os.stat(value)
+                    digest.update(f"{file_stat.st_size}:{file_stat.st_mtime_ns};".encode('utf-8'))
+        for key in RESULT_OPTIONS:
+            digest.update(f"{key}={self.config.config[key]!r};".encode('utf-8'))
+        return digest.hexdigest()
+
+    def decode(self, input_stream, output_stream) -> bool:
+        try:
+            _log.info("-- Starting FST Decoder --")
+            
+            output = OutputBuffer(output_stream, binary=self.config.config['output_format'] == 'ids-bin')
+            try:
+                if self.config.config['input_format'] in ('text', 'ids'):
+                    success = self._process_text(input_stream, output)
+                elif self.config.config['input_format'] == 'ids-bin':
+                    success = self._process_text(_read_id_records(getattr(input_stream, 'buffer', input_stream)),
+                                                 output)
+                elif self.config.config['input_format'] == 'fst':
+                    success = self._process_fst(input_stream, output)
+                else:
+                    raise DecoderError(f"Unsupported input format: {self.config.config['input_format']}")
+            finally:
+                output.flush()
+
+            cache_file = self.config.config['cache_file']
+            if self.cache is not None and cache_file:
+                self.cache.save(cache_file)
+                _log.info(f"Saved {len(self.cache.entries)} cached results to: {cache_file}")
+
+            self._report_stats()
+            self._write_profile()
+            return success
+                
+        except Exception as e:
+            _log.error(f"ERROR: {str(e)}")
+            return False
+    
+    def _process_text(self, input_stream, output: OutputBuffer) -> bool:
+        if self.config.config['jobs'] > 1:
+            return self._process_text_parallel(input_stream, output)
+
+        for lineno, line in enumerate(input_stream):
+            line_output = self._decode_line(lineno, line)
+            if line_output is not None:
+                with self._stage('write'):
+                    output.write_line(line_output)
+                
+        return True
+
+    def _process_text_parallel(self, input_stream, output: OutputBuffer) -> bool:
+        """Decode line chunks in forked worker processes, writing results in input order"""
+        global _worker_decoder
+        jobs = self.config.config['jobs']
+        chunk_size = max(1, self.config.config['chunk_size'])
+
+        import multiprocessing
+        try:
+            ctx = multiprocessing.get_context('fork')
+        except ValueError:
+            raise DecoderError("Parallel decoding requires the 'fork' start method")
+
+        # Workers are forked after the models are loaded, so they share the
+        # loaded FSTs copy-on-write instead of reading them again.
+        _worker_decoder = self
+        _log.info(f"Decoding with {jobs} worker processes, {chunk_size} lines per chunk on average")
+        # Buffered log lines would otherwise be written again by every forked worker
+        _log.flush()
+
+        # Lines are read in windows; each window is cut into size-balanced chunks
+        # dispatched longest first, so long lines start early instead of
+        # finishing last. At most two windows are in flight, which bounds memory.
+        chunks_per_window = jobs * 4
+        windows = deque()
+        with ctx.Pool(jobs) as pool:
+            for window in _read_chunks(input_stream, chunk_size * chunks_per_window):
+                windows.append(self._dispatch_window(pool, window, chunks_per_window))
+                while len(windows) > 1:
+                    self._collect_window(windows.popleft(), output)
+            while windows:
+                self._collect_window(windows.popleft(), output)
+
+        _worker_decoder = None
+        return True
+
+    def _dispatch_window(self, pool, window, num_chunks: int):
+        """Split a window of lines into chunks of similar total length and submit them longest first"""
+        order = sorted(range(len(window)), key=lambda position: len(window[position][1]), reverse=True)
+        target = sum(len(line) for _, line in window) / num_chunks
+        chunks = []
+        chunk, chunk_cost = [], 0
+        for position in order:
+            chunk.append(position)
+            chunk_cost += len(window[position][1])
+            if chunk_cost >= target:
+                chunks.append(chunk)
+                chunk, chunk_cost = [], 0
+        if chunk:
+            chunks.append(chunk)
+
+        results = [pool.apply_async(_decode_chunk, ([window[position] for position in chunk],))
+                   for chunk in chunks]
+        return len(window), chunks, results
+
+    def _collect_window(self, dispatched, output: OutputBuffer):
+        """Wait for a window's chunks and write its outputs in input order"""
+        size, chunks, results = dispatched
+        outputs = [None] * size
+        for chunk, result in zip(chunks, results):
+            for position, line_output in zip(chunk, self._merge_chunk(result.get())):
+                outputs[position] = line_output
+        for line_output in outputs:
+            if line_output is not None:
+                output.write_line(line_output)
+
+    def _merge_chunk(self, result) -> List[Optional[str]]:
+        """Merge a finished chunk's statistics and cache entries, returning its outputs"""
+        outputs, stats, cache_entries, profiler = result
+        self.stats.update(stats)
+        if profiler is not None:
+            self.profiler.merge(profiler)
+        for key, hypotheses in cache_entries:
+            self.cache.put(key, hypotheses)
+        return outputs
+
+    def _process_fst(self, input_stream, output: OutputBuffer) -> bool:
+        """Decode precompiled input lattices from a FAR archive or a stream of binary FSTs.
+
+        The archive is read from input_file when configured, otherwise from the
+        input stream. Each lattice is composed with the models as it is; its
+        output labels must already be in the first model's input label space.
+        """
+        input_file = self.config.config['input_file']
+        if input_file:
+            return self._process_far(input_file, output)
+
+        # FarReader needs a file it can open, so spool the stream to disk first
+        import tempfile
+        with tempfile.NamedTemporaryFile(suffix='.far') as spool:
+            source = getattr(input_stream, 'buffer', input_stream)
+            while True:
+                block = source.read(1 << 20)
+                if not block:
+                    break
+                spool.write(block)
+            spool.flush()
+            return self._process_far(spool.name, output)
+
+    def _process_far(self, far_file: str, output: OutputBuffer) -> bool:
+        try:
+            reader = pynini.Far(far_file, mode='r')
+        except Exception as e:
+            raise DecoderError(f"Failed to open FST input {far_file}: {str(e)}")
+
+        if reader.far_type() == 'fst':
+            # Not an archive but binary FSTs, possibly several written back to back
+            return self._process_fst_file(far_file, output)
+
+        while not reader.done():
+            lattice_output = self._decode_lattice(reader.get_key(), reader.get_fst())
+            if lattice_output is not None:
+                output.write_line(lattice_output)
+            reader.next()
+
+        return True
+
+    def _process_fst_file(self, fst_file: str, output: OutputBuffer) -> bool:
+        """Decode every FST of a file of concatenated binary FSTs, keyed by their position"""
+        with open(fst_file, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            offset = 0
+            index = 0
+            while offset < len(data):
+                try:
+                    length = _fst_length(data, offset)
+                except struct.error:
+                    length = len(data) + 1
+                if offset + length > len(data):
+                    raise DecoderError(f"FST {index} of the input is truncated")
+                lattice = pynini.Fst.read_from_string(data[offset:offset + length])
+                lattice_output = self._decode_lattice(index, lattice)
+                if lattice_output is not None:
+                    output.write_line(lattice_output)
+                offset += length
+                index += 1
+
+        return True
+
+    def _decode_lattice(self, key, lattice) -> Optional[str]:
+        """Decode one precompiled input lattice, returning the formatted output or None"""
+        start_time = time.perf_counter() if self.profiler else 0.0
+        try:
+            best_fst = self._search(lattice)
+            if best_fst.start() == -1:
+                _log.warning("WARNING: no path found", line=key)
+                return None
+
+            with self._stage('format'):
+                output = self._format_result(best_fst, key)
+            self.sentence_id += 1
+            if self.profiler:
+                self.profiler.sentence(time.perf_counter() - start_time)
+            return output
+
+        except Exception as e:
+            if self.config.config['show_id']:
+                _log.info(f"# Skipped lattice {key}: {str(e)}", line=key, error=str(e))
+            return None
+
+    def _decode_line(self, lineno: int, line: str) -> Optional[str]:
+        """Decode one input line, returning the formatted output or None if skipped"""
+        tokens, segments = self._split_line(line)
+        if not tokens:
+            return None
+            
+        start_time = time.perf_counter() if self.profiler else 0.0
+        try:
+            hypotheses = self._decode_split_line(tokens, segments)
+            if not hypotheses:
+                _log.warning("WARNING: no path found", line=lineno)
+                return None
+            
+            with self._stage('format'):
+                output = self._format_hypotheses(hypotheses, lineno)
+            self.sentence_id += 1
+            if self.profiler:
+                self.profiler.sentence(time.perf_counter() - start_time)
+            if _log.sample_every and _log.sample():
+                self._log_sentence(lineno, tokens, hypotheses)
+            return output
+            
+        except Exception as e:
+            #print(f"ERROR processing sentence: {str(e)}", file=sys.stderr)
+            if self.config.config['show_id']:
+                _log.info(f"# Skipped line {lineno}: {tokens}", line=lineno, error=str(e))
+
+            return None
+
+    def _split_line(self, line):
+        """Return the tokens of a line and its segments, or None when the line is not split.
+
+        Segments are (tokens, boundary) pairs. A line is cut after each boundary
+        symbol, which is written back as its own word with the output label in
+        boundary, and at whitespace runs, which only force a word break.
+        """
+        tokens = _line_tokens(line)
+        boundaries = self.split_boundaries
+        if boundaries is None or len(tokens) < self.config.config['split_min_tokens']:
+            return tokens, None
+
+        if self.config.config['split_whitespace'] and isinstance(line, str):
+            pieces = [piece.split() for piece in _WHITESPACE_RUN.split(line.strip())]
+        else:
+            pieces = [tokens]
+        segments = []
+        for piece in pieces:
+            segment = []
+            for token in piece:
+                if token in boundaries:
+                    segments.append((segment, boundaries[token]))
+                    segment = []
+                else:
+                    segment.append(token)
+            if segment:
+                segments.append((segment, None))
+        if len(segments) == 1 and segments[0][1] is None:
+            return tokens, None
+        return tokens, segments
+
+    def _decode_split_line(self, tokens: List[str], segments):
+        """Return the hypotheses of a line, decoding the segments of a split line independently.
+
+        Each segment is decoded like a whole line, so segments share the cache
+        with whole lines; their hypotheses are stitched back together per line.
+        """
+        if segments is None:
+            return self._decode_tokens(tokens)
+
+        self.stats['split_lines'] += 1
+        nbest = max(self.config.config['nbest'], 1)
+        hypotheses = [([], 0.0)]
+        for segment, boundary in segments:
+            if segment:
+                self.stats['split_segments'] += 1
+                segment_hypotheses = self._decode_tokens(segment)
+                if not segment_hypotheses:
+                    return []
+                # Costs add across segments, so the n best lines combine n best segments
+                hypotheses = heapq.nsmallest(nbest, [([*olabels, *segment_olabels], cost + segment_cost)
+                                                     for (olabels, cost), (segment_olabels, segment_cost)
+                                                     in product(hypotheses, segment_hypotheses)],
+                                             key=lambda hypothesis: hypothesis[1])
+            if boundary is not None:
+                hypotheses = [([*olabels, boundary], cost) for olabels, cost in hypotheses]
+        return hypotheses
+
+    def _log_sentence(self, lineno: int, tokens: List[str], hypotheses):
+        """Log the diagnostics of a sampled sentence"""
+        olabels, cost = hypotheses[0]
+        unknown = 0 if self.ids_input else sum(1 for token in tokens if token not in self.config.input_labels)
+        _log.info(f"Line {lineno}: {len(tokens)} tokens, {unknown} unknown, cost {cost:g}",
+                  event='sentence', line=lineno, tokens=len(tokens), unknown=unknown,
+                  hypotheses=len(hypotheses), cost=cost, words=sum(1 for olabel in olabels if olabel))
+
+    def _decode_tokens(self, tokens: List[str]):
+        """Return the (output labels, cost) hypotheses for a token sequence, best first"""
+        if self.cache is None:
+            return self._search_tokens(tokens)
+
+        key = (self.fingerprint, tuple(tokens))
+        hypotheses = self.cache.get(key)
+        if hypotheses is not None:
+            self.stats['cache_hits'] += 1
+            return hypotheses
+        self.stats['cache_misses'] += 1
+        hypotheses = self._search_tokens(tokens)
+        self.cache.put(key, hypotheses)
+        if self.cache_journal is not None:
+            self.cache_journal.append((key, hypotheses))
+        return hypotheses
+
+    def _search_tokens(self, tokens: List[str]):
+        """Run the configured search for a token sequence"""
+        if self.search_model is not None:
+            hypotheses = self._search_sentence(tokens)
+            if hypotheses is not None:
+                return hypotheses
+
+        with self._stage('make_input_fst'):
+            input_fst = self._make_input_fst(tokens)
+        best_fst = self._search(input_fst)
+        with self._stage('extract_paths'):
+            return sorted(self._enumerate_paths(best_fst), key=lambda path: path[1])
+    
+    def _search_sentence(self, tokens: List[str]):
+        """Decode with the whole-sentence search of the only model.
+
+        Returns None when the search leaves the sentence to pynini (a tied best
+        path of the viterbi search), so the output stays identical.
+        """
+        self.stats['search_sentences'] += 1
+        sentence = tokens if self.search_model.SEARCH_INPUT == 'tokens' else self._token_labels(tokens)
+        with self._stage(self.search):
+            hypotheses = self.search_model.search(sentence, self.config.config['nbest'])
+        if hypotheses is None:
+            self.stats['search_fallbacks'] += 1
+        return hypotheses
+
+    def _token_labels(self, tokens: List[str]) -> List[int]:
+        """Map input tokens to labels, substituting the unknown symbol"""
+        if self.ids_input:
+            try:
+                labels = [int(token) for token in tokens]
+            except ValueError as e:
+                raise DecoderError(f"Bad label in ids input: {str(e)}")
+            if min(labels) <= 0:
+                raise DecoderError("Input labels must be positive")
+            return labels
+        if self.config.symbol_tables['input'] is None:
+            raise DecoderError("No input symbol table")
+        input_labels = self.config.input_labels
+        labels = []
+        self.unknown_words = []
+        for token in tokens:
+            label = input_labels.get(token, -1)
+            if label == -1:
+                if self.config.unknown_id == -1:
+                    raise DecoderError(f"Unknown token '{token}'")
+                label = self.config.unknown_id
+                self.unknown_words.append(token)
+            labels.append(label)
+        return labels
+
+    def _make_input_fst(self, tokens: List[str]):
+        """Create the linear input FST of a token sequence"""
+        try:
+            return self._labels_fst(self._token_labels(tokens))
+        except Exception as e:
+            raise DecoderError(f"Input FST creation failed: {str(e)}")
+
+    @staticmethod
+    def _labels_fst(labels: List[int]):
+        """Build a linear acceptor over labels in one call.
+
+        Bracketed integers in a pynini string are raw labels, so the whole
+        chain is compiled from a pre-mapped string rather than arc by arc.
+        The acceptor has no symbol tables, which composition does not need.
+        """
+        return pynini.accep("".join([f"[{label}]" for label in labels]))
+
+    def _search(self, search_fst):
+        """Compose an input FST or lattice with the model cascade and extract the best paths"""
+        try:
+            input_states = _num_states(search_fst)
+            for index, model in enumerate(self.models):
+                if _log.debug_enabled:
+                    _log.debug(f"Composing with model: {model.config['file']}", model=index)
+                
+                # Perform composition
+                with self._stage(f"compose[{index}]"):
+                    composed = model.compose(search_fst)
+                if self.profiler:
+                    self.profiler.lattice(f"compose[{index}]", composed)
+                if composed.start() == -1:
+                    # Symbol tables are reconciled at load, so this is an input the models do not accept
+                    if _log.debug_enabled:
+                        _log.debug(f"No path through model: {model.config['file']}", model=index)
+                    return composed
+                    
+                search_fst = self._prune_lattice(composed, input_states)
+                
+            with self._stage('shortestpath'):
+                return self._shortest_paths(search_fst)
+            
+        except Exception as e:
+            raise DecoderError(f"Path finding error: {str(e)}")
+
+    def tune(self, input_stream, output_stream) -> bool:
+        """Grid-search the model weights on a dev set, scoring word boundary F1 against references.
+
+        Only the weight ratios change the best paths, so each weight vector is
+        normalized by its first weight. Per sentence, the composed lattices of
+        every weight prefix are kept and shared by all vectors with that
+        prefix; the input composed with the first model is built only once.
+        """
+        with open(self.config.config['tune'], 'r', encoding='utf-8') as f:
+            references = [line.split() for line in f]
+
+        vectors = sorted(set(tuple(weight / grid_vector[0] for weight in grid_vector)
+                             for grid_vector in self._weight_grid() if grid_vector[0] > 0))
+        if not vectors:
+            raise ConfigError("The tuning grid has no vector with a positive first weight")
+        _log.info(f"Tuning {len(self.models)} model weights over {len(vectors)} normalized weight vectors")
+
+        counts = {vector: [0, 0, 0] for vector in vectors}  # true positives, false positives, false negatives
+        compositions = 0
+        sentences = 0
+        for lineno, line in enumerate(input_stream):
+            tokens = line.split()
+            if not tokens or lineno >= len(references):
+                continue
+            sentences += 1
+            try:
+                lattices = {(): self._make_input_fst(tokens)}
+            except DecoderError:
+                lattices = None
+            for vector in vectors:
+                words = None
+                if lattices is not None:
+                    olabels, composed = self._search_weighted(lattices, vector)
+                    compositions += composed
+                    if olabels is not None:
+                        words = self._labels_to_string(olabels).split()
+                _count_boundaries(counts[vector], references[lineno], words)
+
+        results = sorted(((_f_score(counts[vector]), vector) for vector in vectors), reverse=True)
+        print("weights\tprecision\trecall\tf1", file=output_stream)
+        for (precision, recall, f1), vector in results:
+            weights = ",".join(f"{weight:g}" for weight in vector)
+            print(f"{weights}\t{precision:.4f}\t{recall:.4f}\t{f1:.4f}", file=output_stream)
+
+        (_, _, best_f1), best = results[0]
+        if _log.json_lines:
+            _log.info("Tuning results", event='tuning', sentences=sentences, compositions=compositions,
+                      results=[{'weights': vector, 'precision': precision, 'recall': recall, 'f1': f1}
+                               for (precision, recall, f1), vector in results])
+        _log.info(f"Tuning: {sentences} sentences, {compositions} compositions "
+                  f"({sentences * len(vectors) * len(self.models)} without lattice reuse)")
+        _log.info(f"Best weights: {','.join(f'{weight:g}' for weight in best)} (F1 {best_f1:.4f})")
+        return True
+
+    def _search_weighted(self, lattices, vector):
+        """1-best output labels for a weight vector, composing only the prefixes not in lattices"""
+        composed = 0
+        lattice = lattices[()]
+        input_states = lattice.num_states()
+        for depth, model in enumerate(self.models, 1):
+            prefix = vector[:depth]
+            cached = lattices.get(prefix)
+            if cached is None:
+                cached = self._prune_lattice(model.compose(lattice, vector[depth - 1]), input_states)
+                lattices[prefix] = cached
+                composed += 1
+            lattice = cached
+            if lattice.start() == -1:
+                return None, composed
+
+        paths = list(self._enumerate_paths(pynini.shortestpath(lattice)))
+        return (paths[0][0] if paths else None), composed
+
+    def _weight_grid(self):
+        """Weight vectors from tune_grid: per-model comma-separated values, models separated by ';'"""
+        default = [0.25, 0.5, 1.0, 2.0, 4.0]
+        groups = (self.config.config['tune_grid'] or "").split(';')
+        axes = []
+        for index in range(len(self.models)):
+            if index < len(groups) and groups[index].strip():
+                axes.append([float(value) for value in groups[index].split(',')])
+            else:
+                axes.append([1.0] if index == 0 else default)
+        return product(*axes)
+
+    def _shortest_paths(self, lattice):
+        """Extract the n-best paths, optionally suppressing duplicate output strings"""
+        nbest = max(1, self.config.config['nbest'])
+        if nbest == 1:
+            return pynini.shortestpath(lattice)
+
+        unique = not self.config.config['print_duplicates']
+        if unique:
+            # Unique n-best requires an acceptor; hypotheses only differ by
+            # their output strings, so project onto the output side first.
+            lattice = lattice.copy().project("output").rmepsilon()
+        return pynini.shortestpath(lattice, nshortest=nbest, unique=unique)
+
+    def _prune_lattice(self, lattice, input_states: int):
+        """Apply weight-threshold (trim) and state-count (beam) pruning to a composed lattice.
+
+        beam_width caps the states kept at beam_width per state of the input (per
+        position of a text input), so the cap grows with the sentence length.
+        OpenFst's prune spends that budget on every state it reaches best-first,
+        including the off-path successors of the best path's states, so no fixed
+        cap is sure to keep the 1-best path. The beam therefore only removes
+        competing paths: whenever the pruned lattice loses the best cost, the cap
+        is doubled and the lattice pruned again. Of several tied best paths only
+        one is sure to survive, and in a cascade a later model can still prefer
+        a path the beam cut from an earlier lattice. The trim threshold is
+        relative to the best path and never removes it.
+        """
+        beam_width = self.config.config['beam_width']
+        trim_width = self.config.config['trim_width']
+        if beam_width <= 0 and trim_width <= 0:
+            return lattice
+
+        weight = trim_width if trim_width > 0 else None
+        with self._stage('prune'):
+            if beam_width <= 0:
+                pruned = pynini.prune(lattice, weight=weight)
+            else:
+                nstate = beam_width * input_states
+                best_cost = _best_cost(lattice)
+                while True:
+                    pruned = pynini.prune(lattice, nstate=nstate, weight=weight)
+                    if nstate >= lattice.num_states() or _best_cost(pruned) <= best_cost + CSRModel.TIE_DELTA:
+                        break
+                    self.stats['widened_beams'] += 1
+                    nstate *= 2
+
+        # State counts are free on the composed vector FSTs; counting arcs walks
+        # the lattice, so it is left to profiling runs
+        self.stats['pruned_lattices'] += 1
+        self.stats['states_before_pruning'] += lattice.num_states()
+        self.stats['states_after_pruning'] += pruned.num_states()
+        if self.profiler:
+            self.stats['arcs_before_pruning'] += _lattice_size(lattice)[1]
+            self.stats['arcs_after_pruning'] += _lattice_size(pruned)[1]
+        return pruned
+
+    def _stage(self, name: str):
+        """Context manager timing a decoding stage when profiling is enabled"""
+        if self.profiler is None:
+            return _NO_PROFILE
+        return self.profiler.stage(name)
+
+    def _write_profile(self):
+        """Write the profile report as JSON and print the latency summary"""
+        profile_file = self.config.config['profile']
+        if self.profiler is None or not profile_file:
+            return
+        report = self.profiler.write(profile_file)
+        latency = report['latency_ms']
+        _log.info(f"Profile: {report['sentences']} sentences, latency p50 {latency['p50']:.2f} ms, "
+                  f"p95 {latency['p95']:.2f} ms, p99 {latency['p99']:.2f} ms; written to: {profile_file}",
+                  event='profile', sentences=report['sentences'], latency_ms=latency, file=profile_file)
+
+    def _report_stats(self):
+        """Print a summary of the collected decoding statistics"""
+        if _log.json_lines:
+            _log.info("Decoding statistics", event='stats', **self.stats)
+        if self.stats['server_batches']:
+            _log.info(f"Server: {self.stats['server_requests']} requests in {self.stats['server_batches']} micro-batches "
+                      f"(average {self.stats['server_requests'] / self.stats['server_batches']:.1f} per batch)")
+        lookups = self.stats['cache_hits'] + self.stats['cache_misses']
+        if lookups:
+            _log.info(f"Result cache: {self.stats['cache_hits']}/{lookups} hits "
+                      f"({100.0 * self.stats['cache_hits'] / lookups:.1f}%)")
+        if self.stats['split_lines']:
+            _log.info(f"Segment splitting: {self.stats['split_lines']} lines split into "
+                      f"{self.stats['split_segments']} segments")
+        if self.stats['search_sentences']:
+            _log.info(f"{self.search.capitalize()} search: {self.stats['search_sentences']} sentences, "
+                      f"{self.stats['search_fallbacks']} left to pynini")
+        if self.stats['pruned_lattices']:
+            states_before = self.stats['states_before_pruning']
+            arcs_before = self.stats['arcs_before_pruning']
+            states_removed = states_before - self.stats['states_after_pruning']
+            arcs_removed = arcs_before - self.stats['arcs_after_pruning']
+            message = (f"Pruning (beam={self.config.config['beam_width']}, trim={self.config.config['trim_width']}): "
+                       f"{self.stats['pruned_lattices']} lattices, "
+                       f"removed {states_removed}/{states_before} states "
+                       f"({100.0 * states_removed / max(states_before, 1):.1f}%)")
+            if arcs_before:
+                message += f", {arcs_removed}/{arcs_before} arcs ({100.0 * arcs_removed / max(arcs_before, 1):.1f}%)"
+            if self.stats['widened_beams']:
+                message += f", beam widened {self.stats['widened_beams']} times to keep the best path"
+            _log.info(message)
+
+    def _format_result(self, result_fst, lineno: int) -> str:
+        """Format the best paths as output lines, one hypothesis per line"""
+        try:
+            hypotheses = sorted(self._enumerate_paths(result_fst), key=lambda path: path[1])
+            return self._format_hypotheses(hypotheses, lineno)
+
+        except Exception as e:
+            raise DecoderError(f"Output generation error: {str(e)}")
+
+    def _format_hypotheses(self, hypotheses, lineno):
+        """Format (output labels, cost) hypotheses as output lines, or as packed records for ids-bin"""
+        output_format = self.config.config['output_format']
+        if output_format == 'ids-bin':
+            # FAR inputs are keyed by name; their records carry the running sentence number
+            index = lineno if isinstance(lineno, int) else self.sentence_id
+            return b"".join([_pack_hypothesis(index, olabels, cost) for olabels, cost in hypotheses])
+
+        show_score = (self.config.config['nbest'] > 1 or output_format == 'score')
+        
+        lines = []
+        for olabels, cost in hypotheses:
+            if output_format == 'ids':
+                output_str = " ".join([str(olabel) for olabel in olabels if olabel])
+            else:
+                # Convert to string using symbol tables
+                output_str = self._labels_to_string(olabels)
+            if show_score:
+                output_str = f"{output_str}|||{cost:g}"
+            if self.config.config['show_id']:
+                lines.append(f"{lineno}|||{output_str}")
+            else:
+                lines.append(output_str)
+        return "\n".join(lines)
+
+    def _enumerate_paths(self, result_fst):
+        """Yield (output labels, cost) for every path of a shortest-path FST.
+
+        Each path is read in one pass by OpenFst's path iterator; epsilon
+        output labels are dropped.
+        """
+        if result_fst.start() == -1:
+            return
+        paths = result_fst.paths()
+        while not paths.done():
+            yield [olabel for olabel in paths.olabels() if olabel], float(paths.weight())
+            paths.next()
+
+    def _labels_to_string(self, olabels) -> str:
+        """Map output labels to a space separated string, skipping epsilons"""
+        output_words = self.config.output_words
+        num_words = len(output_words)
+        words = []
+        for olabel in olabels:
+            # Split boundaries missing from the output table are kept as symbols
+            if isinstance(olabel, str):
+                words.append(olabel)
+            # Handle output symbols
+            elif output_words:
+                out_sym = output_words[olabel] if 0 <= olabel < num_words else None
+                if out_sym is None or out_sym == "<eps>":
+                    continue  # skip epsilon and undefined
+                words.append(out_sym)
+            elif olabel != 0:
+                words.append(str(olabel))
+        return " ".join(words)
+
+    def _get_input_symbol(self, label: int, unk_idx: int) -> str:
+        if label == self.config.unknown_id:
+            if unk_idx < len(self.unknown_words):
+                return self.unknown_words[unk_idx]
+            return "<unk>"
+        return self.config.symbol_tables['input'].find(label) or str(label)
+    
+    def _get_output_symbol(self, label: int, unk_idx: int) -> str:
+        if label == self.config.unknown_id:
+            if unk_idx < len(self.unknown_words):
+                return self.unknown_words[unk_idx]
+            return "<unk>"
+        return self.config.symbol_tables['output'].find(label) or str(label)
+
+# Compiled bundles start with this line, followed by a pickled dict
+BUNDLE_MAGIC = b"FST_DECODER_BUNDLE\n"
+BUNDLE_VERSION = 1
+# Options of the run that sets them (actions, run files and logging), which neither
+# bundles nor converted configs keep
+RUN_OPTIONS = ('compile_bundle', 'convert_models', 'prepare_cache_dir', 'profile', 'tune', 'tune_grid',
+               'serve', 'input_file', 'cache_file', 'log_level', 'log_format', 'log_file', 'log_sample')
+# A bundle cannot be edited, so it also leaves out the per-run input and output handling,
+# search limits and parallelism; it keeps the models, symbols and engine
+BUNDLE_RUNTIME_OPTIONS = RUN_OPTIONS + ('input_format', 'output_format', 'nbest', 'beam_width', 'trim_width',
+                                        'print_duplicates', 'print_input', 'print_all', 'sample', 'show_id',
+                                        'jobs', 'chunk_size', 'cache_size', 'batch_window_ms', 'max_batch')
+
+def _is_bundle(path: str) -> bool:
+    try:
+        with open(path, 'rb') as f:
+            return f.read(len(BUNDLE_MAGIC)) == BUNDLE_MAGIC
+    except OSError:
+        return False
+
+# Options that change decoding results, and model config keys naming files, for the cache fingerprint
+RESULT_OPTIONS = ('input_format', 'input_symbols', 'output_symbols', 'unknown_symbol', 'nbest', 'beam_width',
+                  'trim_width', 'print_duplicates', 'weights', 'negative_probs', 'prepare')
+RESULT_FILE_KEYS = ('file', 'vocab', 'input_symbols', 'output_symbols')
+
+# Myanmar clause and sentence punctuation, the characters script/rm_myanmar_punct.py removes
+MYANMAR_PUNCTUATION = ('၊', '။')
+# Two or more whitespace characters between tokens mark a segment break in text input
+_WHITESPACE_RUN = re.compile(r'\s{2,}')
+
+# Stage context used when profiling is off
+_NO_PROFILE = nullcontext()
+
+# Decoder shared with forked worker processes (set just before the pool is created)
+_worker_decoder = None
+
+def _compose(lattice, model_fst):
+    """pynini.compose that also takes an immutable (const) model FST"""
+    if isinstance(model_fst, pynini.Fst):
+        return pynini.compose(lattice, model_fst)
+    return pynini.Fst.from_pywrapfst(fst.compose(lattice, model_fst))
+
+def _best_cost(lattice) -> float:
+    """Cost of the best complete path through a lattice, infinite when it has none"""
+    distance = pynini.shortestdistance(lattice, reverse=True)
+    if not 0 <= lattice.start() < len(distance):
+        return float('inf')
+    return float(distance[lattice.start()])
+
+def _num_states(model_fst) -> int:
+    """Number of states of a mutable or const FST (the latter has no num_states())"""
+    if isinstance(model_fst, fst.MutableFst):
+        return model_fst.num_states()
+    return sum(1 for _ in model_fst.states())
+
+def _numpy():
+    """Import NumPy on first use: only the CSR code paths need it, and importing
+    it at startup would slow down every decoder that does not"""
+    try:
+        import numpy
+    except ImportError:
+        raise ConfigError("CSR arrays (the viterbi engine) require numpy")
+    return numpy
+
+def _element_sequence(array):
+    """Python-indexable view of a CSR array: a list copy, or a memoryview of a memory-mapped array"""
+    if isinstance(array, _numpy().memmap):
+        return memoryview(array)
+    return array.tolist()
+
+def _memory_status() -> Optional[Dict[str, int]]:
+    """Memory counters of this process in KiB, from /proc/self/status (None where unavailable)"""
+    try:
+        with open('/proc/self/status') as f:
+            return {key: int(value.split()[0]) for key, value in (line.split(':', 1) for line in f)
+                    if value.strip().endswith('kB')}
+    except (OSError, ValueError):
+        return None
+
+def _mapped_memory(directory: str) -> Tuple[int, int, int]:
+    """Mapped, resident and shared KiB of this process's mappings of files under a directory, from /proc/self/smaps"""
+    prefix = os.path.join(os.path.abspath(directory), '')
+    size = resident = shared = 0
+    mapped = False
+    try:
+        with open('/proc/self/smaps') as f:
+            for line in f:
+                fields = line.split()
+                if not line[0].isupper():
+                    # Mapping header: address perms offset dev inode [path]
+                    mapped = len(fields) >= 6 and fields[5].startswith(prefix)
+                elif mapped and fields[0] == 'Size:':
+                    size += int(fields[1])
+                elif mapped and fields[0] == 'Rss:':
+                    resident += int(fields[1])
+                elif mapped and fields[0] in ('Shared_Clean:', 'Shared_Dirty:'):
+                    shared += int(fields[1])
+    except OSError:
+        pass
+    return size, resident, shared
+
+def _lattice_size(lattice):
+    """Return the (states, arcs) size of an FST"""
+    return _num_states(lattice), sum(lattice.num_arcs(state) for state in lattice.states())
+
+def _percentile(sorted_values, percent: float):
+    """Nearest-rank percentile of an ascending list (0 for an empty list)"""
+    if not sorted_values:
+        return 0
+    rank = max(1, -(-len(sorted_values) * percent // 100))
+    return sorted_values[int(rank) - 1]
+
+# ids-bin records: input is an int32 label count followed by the labels; each output
+# hypothesis is (int32 line index, float32 cost, int32 label count) followed by the labels
+_INT32 = struct.Struct('<i')
+_HYPOTHESIS_HEADER = struct.Struct('<ifi')
+
+def _read_id_records(stream):
+    """Yield the label tuples of a packed little-endian int32 input stream"""
+    while True:
+        header = stream.read(_INT32.size)
+        if not header:
+            return
+        if len(header) < _INT32.size:
+            raise DecoderError("Truncated ids-bin input")
+        (count,) = _INT32.unpack(header)
+        body = stream.read(_INT32.size * count)
+        if len(body) < _INT32.size * count:
+            raise DecoderError("Truncated ids-bin input")
+        yield struct.unpack(f'<{count}i', body)
+
+def _pack_hypothesis(index: int, olabels, cost: float) -> bytes:
+    labels = [olabel for olabel in olabels if olabel]
+    return _HYPOTHESIS_HEADER.pack(index, cost, len(labels)) + struct.pack(f'<{len(labels)}i', *labels)
+
+# Binary FST layout (OpenFst FstHeader and SymbolTable) needed to find where one
+# FST of a stream ends: magic numbers and the header flags
+_FST_MAGIC = 2125659606
+_SYMBOL_TABLE_MAGIC = 2125658996
+_FST_HAS_ISYMBOLS = 1
+_FST_HAS_OSYMBOLS = 2
+_FST_IS_ALIGNED = 4
+# Header fields after the type strings: version, flags, properties, start, states, arcs
+_FST_HEADER_FIELDS = struct.Struct('<iiQqqq')
+
+def _fst_header(data, offset: int) -> Tuple[str, str, int, int, int, int, int]:
+    """Read the header of the binary FST at offset, skipping its symbol tables.
+
+    Returns (fst type, arc type, flags, start, states, arcs, offset of the body).
+    """
+    (magic,) = _INT32.unpack_from(data, offset)
+    if magic != _FST_MAGIC:
+        raise DecoderError(f"No FST header at byte {offset} of the input")
+    fst_type, position = _unpack_string(data, offset + _INT32.size)
+    arc_type, position = _unpack_string(data, position)
+    _, flags, _, start, num_states, num_arcs = _FST_HEADER_FIELDS.unpack_from(data, position)
+    position += _FST_HEADER_FIELDS.size
+    for flag in (_FST_HAS_ISYMBOLS, _FST_HAS_OSYMBOLS):
+        if flags & flag:
+            position = _skip_symbol_table(data, position)
+    return fst_type, arc_type, flags, start, num_states, num_arcs, position
+
+def _fst_length(data, offset: int) -> int:
+    """Byte length of the binary FST starting at offset in a stream of concatenated FSTs.
+
+    Vector FSTs and unaligned const FSTs with 32-bit weights are measured;
+    other layouts raise instead of misreading the rest of the stream.
+    """
+    fst_type, arc_type, flags, _, num_states, num_arcs, position = _fst_header(data, offset)
+    if arc_type not in ('standard', 'log') or flags & _FST_IS_ALIGNED or fst_type not in ('vector', 'const'):
+        raise DecoderError(f"Cannot read a stream of {'aligned ' if flags & _FST_IS_ALIGNED else ''}"
+                           f"{fst_type} FSTs with {arc_type} arcs; write the lattices to a FAR archive")
+    if fst_type == 'const':
+        # State records (final weight, first arc, arcs, input and output epsilons), then the arcs
+        return position + 20 * num_states + 16 * num_arcs - offset
+    # Each state: final weight and arc count, then its (ilabel, olabel, weight, nextstate) arcs
+    for _ in range(num_states):
+        (state_arcs,) = struct.unpack_from('<q', data, position + 4)
+        position += 12 + 16 * state_arcs
+    return position - offset
+
+def _unpack_string(data, offset: int) -> Tuple[str, int]:
+    """Read a length-prefixed OpenFst string, returning it and the offset after it"""
+    (size,) = _INT32.unpack_from(data, offset)
+    start = offset + _INT32.size
+    return bytes(data[start:start + size]).decode('utf-8', errors='replace'), start + size
+
+def _skip_symbol_table(data, offset: int) -> int:
+    """Offset just after a binary symbol table embedded in an FST header"""
+    (magic,) = _INT32.unpack_from(data, offset)
+    if magic != _SYMBOL_TABLE_MAGIC:
+        raise DecoderError(f"Bad symbol table in the FST at byte {offset} of the input")
+    _, position = _unpack_string(data, offset + _INT32.size)
+    _, num_symbols = struct.unpack_from('<qq', data, position)
+    position += 16
+    for _ in range(num_symbols):
+        (size,) = _INT32.unpack_from(data, position)
+        position += _INT32.size + size + 8
+    return position
+
+def _line_tokens(line):
+    """Tokens of a text input line; ids-bin records are already label tuples"""
+    return line.strip().split() if isinstance(line, str) else list(line)
+
+def _same_symbols(source, target) -> bool:
+    """Whether two symbol tables hold the same symbols. Tables read from the same
+    file and not extended since are taken as equal without hashing every symbol."""
+    if (source.name() == target.name() and source.num_symbols() == target.num_symbols()
+            and source.available_key() == target.available_key()):
+        return True
+    return source.labeled_checksum() == target.labeled_checksum()
+
+def _relabel_pairs(source, target):
+    """(old, new) label pairs taking symbols from the source table to the target table.
+
+    Symbols missing from the target table are added to it.
+    """
+    if source is None or _same_symbols(source, target):
+        return []
+    pairs = []
+    for key, symbol in source:
+        new_key = target.find(symbol)
+        if new_key == -1:
+            new_key = target.add_symbol(symbol)
+        if new_key != key:
+            pairs.append((key, new_key))
+    return pairs
+
+def _boundaries(words):
+    """Character offsets of the word boundaries inside a segmented sentence"""
+    boundaries = set()
+    offset = 0
+    for word in words[:-1]:
+        offset += len(word)
+        boundaries.add(offset)
+    return boundaries
+
+def _count_boundaries(counts, reference, words):
+    """Add boundary true positives, false positives and false negatives (as evaluate_segmentation.py)"""
+    reference_bounds = _boundaries(reference)
+    if words is None:
+        counts[2] += len(reference_bounds)
+        return
+    hypothesis_bounds = _boundaries(words)
+    counts[0] += len(reference_bounds & hypothesis_bounds)
+    counts[1] += len(hypothesis_bounds - reference_bounds)
+    counts[2] += len(reference_bounds - hypothesis_bounds)
+
+def _f_score(counts):
+    true_positives, false_positives, false_negatives = counts
+    precision = true_positives / (true_positives + false_positives) if true_positives + false_positives else 0.0
+    recall = true_positives / (true_positives + false_negatives) if true_positives + false_negatives else 0.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    return precision, recall, f1
+
+def _read_chunks(input_stream, chunk_size: int):
+    """Yield lists of (lineno, line) pairs of at most chunk_size lines"""
+    chunk = []
+    for lineno, line in enumerate(input_stream):
+        chunk.append((lineno, line))
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def _decode_chunk(chunk):
+    """Worker entry point: decode a chunk of lines with the inherited decoder"""
+    _worker_decoder.stats = Counter()
+    if _worker_decoder.cache is not None:
+        _worker_decoder.cache_journal = []
+    if _worker_decoder.profiler is not None:
+        _worker_decoder.profiler = StageProfiler()
+    outputs = [_worker_decoder._decode_line(lineno, line) for lineno, line in chunk]
+    return outputs, _worker_decoder.stats, _worker_decoder.cache_journal or [], _worker_decoder.profiler
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="KYFD - A WFST-based decoder")
+    parser.add_argument("config", help="Configuration file (YAML format) or compiled bundle")
+    parser.add_argument("-i", "--input", choices=["text", "ids", "ids-bin", "fst"], dest="input_format",
+                       help="Input format (text, ids: space-separated input labels, "
+                            "ids-bin: int32 label count and labels per sentence, or fst)")
+    parser.add_argument("--input-file", dest="input_file",
+                       help="FAR archive or binary FST file with input lattices (fst input format)")
+    parser.add_argument("-o", "--output", choices=["text", "score", "component", "ids", "ids-bin"],
+                       dest="output_format",
+                       help="Output format (ids: space-separated output labels, ids-bin: int32 line index, "
+                            "float32 cost, int32 label count and labels per hypothesis)")
+    parser.add_argument("-n", "--nbest", type=int, help="Number of best paths to output")
+    parser.add_argument("--print-duplicates", action="store_true", default=None, dest="print_duplicates",
+                       help="Keep n-best hypotheses with identical output strings")
+    parser.add_argument("-w", "--weights", help="Comma-separated list of weights")
+    parser.add_argument("-u", "--unknown", help="Unknown symbol")
+    parser.add_argument("-t", "--terminal", help="Terminal symbol")
+    parser.add_argument("--beam", type=int, dest="beam_width",
+                       help="Beam width: lattice states kept per input position after each composition (widened when it would cut the best path)")
+    parser.add_argument("--trim", type=float, dest="trim_width", help="Trim threshold")
+    parser.add_argument("--engine", choices=["pynini", "viterbi"],
+                       help="Search engine (pynini composition or CSR Viterbi)")
+    parser.add_argument("--print-input", action="store_true", help="Print input sequence")
+    parser.add_argument("--print-all", action="store_true", help="Print all arcs")
+    parser.add_argument("--sample", action="store_true", help="Sample paths instead of shortest path")
+    parser.add_argument("--negative", action="store_true", dest="negative_probs",
+                       help="Treat weights as negative log probabilities")
+    parser.add_argument("--show-id", action="store_true", help="Show original line number in output")
+    parser.add_argument("--cache", type=int, dest="cache_size",
+                       help="Cache the results of up to N distinct sentences")
+    parser.add_argument("--cache-file", dest="cache_file",
+                       help="File to load the result cache from and save it to")
+    parser.add_argument("--tune", metavar="REF_FILE",
+                       help="Grid-search model weights on the input against reference segmentations")
+    parser.add_argument("--tune-grid", dest="tune_grid",
+                       help="Weights to try per model, e.g. '1;0.5,1,2' (default: 1 for the first model, "
+                            "0.25..4 for the others)")
+    parser.add_argument("--log-level", choices=["debug", "info", "warning", "error"], dest="log_level",
+                       help="Lowest level of diagnostics to write")
+    parser.add_argument("--log-format", choices=["text", "json"], dest="log_format",
+                       help="Write diagnostics as plain messages or JSON lines")
+    parser.add_argument("--log-file", dest="log_file", help="Append diagnostics to this file instead of stderr")
+    parser.add_argument("--log-sample", type=float, dest="log_sample",
+                       help="Fraction of decoded sentences whose diagnostics are logged (e.g. 0.01)")
+    parser.add_argument("--profile", metavar="FILE",
+                       help="Write per-stage timings, sentence latency percentiles and lattice sizes as JSON")
+    parser.add_argument("--compile-bundle", metavar="FILE", dest="compile_bundle",
+                       help="Write the loaded models and config to a bundle file and exit")
+    parser.add_argument("--prepare", action="store_true", default=None,
+                       help="Optimize FST models at load (rmepsilon, determinize, minimize, push, arcsort), "
+                            "caching the result")
+    parser.add_argument("--prepare-cache", metavar="DIR", dest="prepare_cache_dir",
+                       help="Directory of cached prepared models (default: ~/.cache/fst_decoder/prepared)")
+    parser.add_argument("--convert-models", metavar="DIR", dest="convert_models",
+                       help="Write the models as const FSTs (with memory-mappable CSR arrays for the "
+                            "viterbi engine), and a config loading them, to DIR and exit")
+    parser.add_argument("--serve", metavar="ADDRESS",
+                       help="Run as a server on unix:PATH or [HOST:]PORT instead of decoding stdin")
+    parser.add_argument("--batch-window", type=float, dest="batch_window_ms",
+                       help="Milliseconds to wait while collecting a server micro-batch")
+    parser.add_argument("--max-batch", type=int, dest="max_batch", help="Maximum server micro-batch size")
+    parser.add_argument("-j", "--jobs", type=int, help="Number of worker processes for parallel decoding")
+    parser.add_argument("--chunk-size", type=int, dest="chunk_size",
+                       help="Average lines per work chunk in parallel decoding")
+    parser.add_argument("--split", action="store_true", default=None,
+                       help="Split lines at boundary symbols and whitespace runs and decode the segments independently")
+    parser.add_argument("--split-symbols", dest="split_symbols",
+                       help="Comma-separated boundary symbols for --split (default: the Myanmar punctuation ၊,။)")
+    parser.add_argument("--split-min-tokens", type=int, dest="split_min_tokens",
+                       help="Only split lines of at least N tokens")
+
+    
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    
+    try:
+        # Log to the chosen destination from the start, so config and bundle loading
+        # messages and errors land there too; a config file can still set logging
+        _log.configure(args.log_level or 'info', args.log_format or 'text', args.log_file, args.log_sample or 0.0)
+        config = DecoderConfig(args.config, vars(args))
+        _log.configure(config.config['log_level'], config.config['log_format'],
+                       config.config['log_file'], config.config['log_sample'])
+        decoder = Decoder(config)
+        if config.config['compile_bundle']:
+            decoder.write_bundle(config.config['compile_bundle'])
+            sys.exit(0)
+        if config.config['convert_models']:
+            decoder.convert_models(config.config['convert_models'])
+            sys.exit(0)
+        if config.config['tune']:
+            success = decoder.tune(sys.stdin, sys.stdout)
+            sys.exit(0 if success else 1)
+        if config.config['serve']:
+            # The server's socket and thread modules are only imported when serving
+            from decoder_server import DecoderServer
+            DecoderServer(decoder, config.config['serve']).serve_forever()
+            sys.exit(0)
+        success = decoder.decode(sys.stdin, sys.stdout)
+        sys.exit(0 if success else 1)
+    except Exception as e:
+        _log.error(f"FATAL ERROR: {str(e)}")
+        sys.exit(1)
+    finally:
+        _log.close()
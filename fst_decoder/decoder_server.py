@@ -0,0 +1,208 @@
+"""
+Server mode of fst_decoder.py (--serve): a long-running decoder answering requests
+over a Unix domain socket or localhost TCP. Imported only when serving, so batch
+decoding does not load the socket and thread modules.
+"""
+
+import os
+import json
+import time
+import stat
+import queue
+import threading
+import socketserver
+from typing import List
+
+from decoder import Decoder, ConfigError, _log
+
+class DecodeRequest:
+    """A sentence waiting to be decoded by the server's batch thread"""
+    __slots__ = ('tokens', 'hypotheses', 'error', 'done')
+
+    def __init__(self, tokens: List[str]):
+        self.tokens = tokens
+        self.hypotheses = None
+        self.error = None
+        self.done = threading.Event()
+
+class DecoderServer:
+    """Long-running decoder serving requests over a Unix domain socket or localhost TCP.
+
+    Each connection sends one request per line, either plain text or a JSON
+    object {"id": ..., "text": ...}, and gets one response line per request
+    in the same order. Requests from all connections that arrive within
+    batch_window_ms are decoded together as one micro-batch by a single
+    decoding thread, so identical sentences in a batch are decoded once and
+    responses are flushed once per batch.
+    """
+
+    def __init__(self, decoder: Decoder, address: str):
+        self.decoder = decoder
+        self.address = address
+        self.batch_window = decoder.config.config['batch_window_ms'] / 1000.0
+        self.max_batch = max(1, decoder.config.config['max_batch'])
+        self.requests = queue.Queue()
+        self.unix_path = None
+
+        server_address, unix_path = _parse_address(address)
+        if unix_path:
+            _remove_stale_socket(unix_path)
+            self.unix_path = unix_path
+            self.server = _ThreadingUnixServer(unix_path, _DecoderRequestHandler)
+        else:
+            self.server = _ThreadingTCPServer(server_address, _DecoderRequestHandler)
+        self.server.decoder_server = self
+
+    def serve_forever(self):
+        batcher = threading.Thread(target=self._batch_loop, daemon=True)
+        batcher.start()
+        _log.info(f"Serving on {self.address} (batch window {self.batch_window * 1000:g} ms, "
+                  f"max batch {self.max_batch})")
+        try:
+            self.server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.server.server_close()
+            if self.unix_path and os.path.exists(self.unix_path):
+                os.unlink(self.unix_path)
+            self.decoder._report_stats()
+            self.decoder._write_profile()
+
+    def submit(self, tokens: List[str]) -> DecodeRequest:
+        request = DecodeRequest(tokens)
+        if tokens:
+            self.requests.put(request)
+        else:
+            request.hypotheses = []
+            request.done.set()
+        return request
+
+    def _batch_loop(self):
+        while True:
+            batch = [self.requests.get()]
+            deadline = time.monotonic() + self.batch_window
+            while len(batch) < self.max_batch:
+                timeout = deadline - time.monotonic()
+                try:
+                    if timeout > 0:
+                        batch.append(self.requests.get(timeout=timeout))
+                    else:
+                        batch.append(self.requests.get_nowait())
+                except queue.Empty:
+                    break
+            self._decode_batch(batch)
+
+    def _decode_batch(self, batch: List[DecodeRequest]):
+        """Decode a micro-batch, decoding each distinct sentence once"""
+        decoder = self.decoder
+        decoder.stats['server_batches'] += 1
+        decoder.stats['server_requests'] += len(batch)
+        results = {}
+        for request in batch:
+            key = tuple(request.tokens)
+            if key not in results:
+                start_time = time.perf_counter()
+                try:
+                    results[key] = (decoder._decode_split_line(*decoder._split_line(request.tokens)), None)
+                except Exception as e:
+                    results[key] = (None, str(e))
+                if decoder.profiler:
+                    decoder.profiler.sentence(time.perf_counter() - start_time)
+            request.hypotheses, request.error = results[key]
+            request.done.set()
+
+class _DecoderRequestHandler(socketserver.StreamRequestHandler):
+    """Read requests from a connection and write responses in request order"""
+
+    def handle(self):
+        server = self.server.decoder_server
+        pending = queue.Queue()
+        writer = threading.Thread(target=self._write_responses, args=(pending,), daemon=True)
+        writer.start()
+
+        try:
+            lineno = 0
+            for raw_line in self.rfile:
+                line = raw_line.decode('utf-8', errors='replace')
+                request_id, is_json = lineno, False
+                lineno += 1
+                if line.lstrip().startswith('{'):
+                    is_json = True
+                    try:
+                        message = json.loads(line)
+                        request_id = message.get('id', request_id)
+                        line = message.get('text')
+                        if not isinstance(line, str):
+                            raise ValueError("'text' must be a string")
+                    except (ValueError, AttributeError) as e:
+                        pending.put((request_id, is_json, self._error_request(f"Invalid JSON request: {str(e)}")))
+                        continue
+                pending.put((request_id, is_json, server.submit(line.split())))
+        finally:
+            # Answer every request already queued, even when reading the connection fails
+            pending.put(None)
+            writer.join()
+
+    @staticmethod
+    def _error_request(error: str) -> DecodeRequest:
+        """A finished request that carries only an error"""
+        request = DecodeRequest([])
+        request.error = error
+        request.done.set()
+        return request
+
+    def _write_responses(self, pending):
+        decoder = self.server.decoder_server.decoder
+        while True:
+            item = pending.get()
+            if item is None:
+                break
+            request_id, is_json, request = item
+            request.done.wait()
+            if is_json:
+                response = {'id': request_id, 'error': request.error, 'hypotheses': [
+                    {'output': decoder._labels_to_string(olabels), 'cost': cost}
+                    for olabels, cost in (request.hypotheses or [])]}
+                text = json.dumps(response, ensure_ascii=False)
+            elif request.hypotheses:
+                # One response line per request, so n-best hypotheses are tab separated
+                text = decoder._format_hypotheses(request.hypotheses, request_id).replace("\n", "\t")
+            else:
+                text = ""
+            try:
+                self.wfile.write(text.encode('utf-8') + b"\n")
+                # Flush once the responses that are ready have been written
+                if pending.empty():
+                    self.wfile.flush()
+            except OSError:
+                break
+
+class _ThreadingUnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+class _ThreadingTCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+def _parse_address(address: str):
+    """Parse unix:PATH, HOST:PORT or PORT into (TCP address, Unix socket path)"""
+    if address.startswith('unix:'):
+        return None, address[len('unix:'):]
+    if '/' in address:
+        return None, address
+    host, _, port = address.rpartition(':')
+    try:
+        return (host or '127.0.0.1', int(port)), None
+    except ValueError:
+        raise ConfigError(f"Invalid server address: {address}")
+
+def _remove_stale_socket(path: str):
+    """Remove a socket left behind at path by an earlier server; any other file is refused"""
+    try:
+        mode = os.lstat(path).st_mode
+    except FileNotFoundError:
+        return
+    if not stat.S_ISSOCK(mode):
+        raise ConfigError(f"Refusing to serve on {path}: it exists and is not a socket")
+    os.unlink(path)
@@ -0,0 +1,261 @@
+"""
+Throughput benchmark for fst_decoder.py.
+Runs decoder configurations over the shipped test sets (and scaled-up copies of them),
+records decoded sentences/sec, peak RSS, startup time and latency percentiles, checks
+each configuration's output against the reference pynini decode, and compares the
+results with a stored baseline. Throughput is timed without --profile; latencies come
+from a separate profiled run.
+Usage:
+    python benchmark_decoder.py --save-baseline baseline.json
+    python benchmark_decoder.py --baseline baseline.json --scale 10 --configs pynini,viterbi,jobs2
+"""
+
+#!/usr/bin/env python3
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import subprocess
+
+DECODER_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+DECODER = os.path.join(DECODER_DIR, 'fst_decoder.py')
+
+# name -> (config file, extra decoder arguments, output must equal the reference decode)
+CONFIGS = {
+    'pynini':  ('config.yaml', [], True),
+    'viterbi': ('config.yaml', ['--engine', 'viterbi'], True),
+    'jobs2':   ('config.yaml', ['--jobs', '2'], True),
+    'cache':   ('config.yaml', ['--cache', '100000'], True),
+    'beam50':  ('config.yaml', ['--beam', '50'], False),
+    'nbest5':  ('config.yaml', ['--nbest', '5'], False),
+    'split':   ('config.yaml', ['--split'], False),
+    'trie':    ('config_trie.yaml', [], False),
+}
+REFERENCE = 'pynini'
+
+# dataset -> decoder arguments it needs (otest.char sentences only decode segment by segment)
+DATASETS = {'data/ctest.char': [], 'data/otest.char': ['--split']}
+
+def scaled_dataset(path, scale, seed, tmp_dir):
+    """Write a copy of the dataset repeated scale times in shuffled order"""
+    with open(path, encoding='utf-8') as f:
+        lines = f.readlines()
+    lines = lines * scale
+    random.Random(seed).shuffle(lines)
+    name = f"{os.path.splitext(os.path.basename(path))[0]}.x{scale}.char"
+    scaled = os.path.join(tmp_dir, name)
+    with open(scaled, 'w', encoding='utf-8') as f:
+        f.writelines(lines)
+    return scaled
+
+def run_decoder(config, extra_args, input_file, output_file, profile_file=None):
+    """Run the decoder once, returning (wall seconds, peak RSS in MB, exit status)"""
+    command = [sys.executable, DECODER, config, '--show-id'] + extra_args
+    if profile_file:
+        command += ['--profile', profile_file]
+    with open(input_file, 'rb') as stdin, open(output_file, 'wb') as stdout:
+        start = time.perf_counter()
+        process = subprocess.Popen(command, cwd=DECODER_DIR, stdin=stdin, stdout=stdout,
+                                   stderr=subprocess.DEVNULL)
+        # wait4 reports the resource usage of this child alone
+        _, status, usage = os.wait4(process.pid, 0)
+        wall = time.perf_counter() - start
+    process.returncode = os.waitstatus_to_exitcode(status)
+    # ru_maxrss is in kilobytes on Linux
+    return wall, usage.ru_maxrss / 1024.0, process.returncode
+
+def decoded_sentences(output_file):
+    """Number of sentences with at least one hypothesis in --show-id output"""
+    sentence_ids = set()
+    with open(output_file, encoding='utf-8') as f:
+        for line in f:
+            sentence_id, separator, _ = line.partition('|||')
+            if separator and not line.startswith('#'):
+                sentence_ids.add(sentence_id)
+    return len(sentence_ids)
+
+def count_differences(output_file, reference_file):
+    with open(output_file, encoding='utf-8') as f:
+        output = f.read().splitlines()
+    with open(reference_file, encoding='utf-8') as f:
+        reference = f.read().splitlines()
+    differences = sum(1 for a, b in zip(output, reference) if a != b)
+    return differences + abs(len(output) - len(reference))
+
+def benchmark(name, dataset, dataset_args, args, tmp_dir, reference_outputs):
+    config, extra_args, exact = CONFIGS[name]
+    extra_args = dataset_args + extra_args
+    label = os.path.basename(dataset)
+    empty_file = os.path.join(tmp_dir, 'empty.char')
+    open(empty_file, 'w').close()
+
+    # Startup: the decoder run on empty input
+    startup = min(run_decoder(config, extra_args, empty_file, os.devnull)[0]
+                  for _ in range(args.repeat))
+
+    # Throughput runs go without --profile, whose per-stage timing slows decoding down
+    best = None
+    output_file = os.path.join(tmp_dir, f"{name}.{label}.hyp")
+    for _ in range(args.repeat):
+        wall, rss, status = run_decoder(config, extra_args, dataset, output_file)
+        if status != 0:
+            return {'config': name, 'dataset': label, 'error': f"decoder exited with status {status}"}
+        if best is None or wall < best[0]:
+            best = (wall, rss)
+
+    profile_file = os.path.join(tmp_dir, f"{name}.{label}.profile.json")
+    status = run_decoder(config, extra_args, dataset, os.devnull, profile_file)[2]
+    if status != 0:
+        return {'config': name, 'dataset': label, 'error': f"profiled decoder exited with status {status}"}
+    with open(profile_file, encoding='utf-8') as f:
+        profile = json.load(f)
+
+    wall, rss = best
+    with open(dataset, encoding='utf-8') as f:
+        lines = sum(1 for line in f if line.strip())
+    decoded = decoded_sentences(output_file)
+    decode_time = max(wall - startup, 1e-9)
+    result = {
+        'config': name,
+        'dataset': label,
+        'lines': lines,
+        'decoded': decoded,
+        'wall_s': round(wall, 4),
+        'startup_s': round(startup, 4),
+        'sentences_per_s': round(decoded / decode_time, 2),
+        'peak_rss_mb': round(rss, 1),
+        'latency_ms': {key: round(value, 3) for key, value in profile['latency_ms'].items()},
+    }
+
+    if name == REFERENCE:
+        # Outputs are only checked against a reference that decodes something
+        if decoded:
+            reference_outputs[label] = output_file
+    elif label in reference_outputs:
+        differences = count_differences(output_file, reference_outputs[label])
+        result['differences'] = differences
+        result['identical'] = differences == 0
+    return result
+
+def compare(results, baseline, args):
+    """Return the list of regressions against the baseline"""
+    previous = {(entry['config'], entry['dataset']): entry for entry in baseline['results']}
+    regressions = []
+    for result in results:
+        if 'error' in result:
+            regressions.append(f"{result['config']} on {result['dataset']}: {result['error']}")
+            continue
+        if result['config'] == REFERENCE and result['decoded'] == 0:
+            regressions.append(f"{result['config']} on {result['dataset']}: decodes none of the "
+                               f"{result['lines']} lines, so throughput and outputs are not comparable")
+        if CONFIGS[result['config']][2] and result.get('identical') is False:
+            regressions.append(f"{result['config']} on {result['dataset']}: "
+                               f"{result['differences']} lines differ from the {REFERENCE} decode")
+        entry = previous.get((result['config'], result['dataset']))
+        if entry is None:
+            continue
+        if result['sentences_per_s'] < entry['sentences_per_s'] * (1.0 - args.max_slowdown):
+            regressions.append(f"{result['config']} on {result['dataset']}: throughput "
+                               f"{result['sentences_per_s']:.1f}/s vs baseline {entry['sentences_per_s']:.1f}/s")
+        if result['startup_s'] > entry['startup_s'] * (1.0 + args.max_startup_growth):
+            regressions.append(f"{result['config']} on {result['dataset']}: startup "
+                               f"{result['startup_s']:.2f}s vs baseline {entry['startup_s']:.2f}s")
+        if result['peak_rss_mb'] > entry['peak_rss_mb'] * (1.0 + args.max_rss_growth):
+            regressions.append(f"{result['config']} on {result['dataset']}: peak RSS "
+                               f"{result['peak_rss_mb']:.1f} MB vs baseline {entry['peak_rss_mb']:.1f} MB")
+    return regressions
+
+def print_table(results):
+    print(f"{'config':<10}{'dataset':<22}{'decoded':>9}{'sent/s':>10}{'startup':>9}{'rss MB':>9}"
+          f"{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}  output")
+    for result in results:
+        if 'error' in result:
+            print(f"{result['config']:<10}{result['dataset']:<22}  {result['error']}")
+            continue
+        latency = result['latency_ms']
+        if result['config'] == REFERENCE:
+            identity = 'reference' if result['decoded'] else 'reference decodes nothing'
+        elif 'identical' not in result:
+            identity = 'unchecked'
+        elif result['identical']:
+            identity = 'identical'
+        else:
+            identity = f"{result['differences']} lines differ"
+        print(f"{result['config']:<10}{result['dataset']:<22}{result['decoded']:>9}{result['sentences_per_s']:>10.1f}"
+              f"{result['startup_s']:>9.2f}{result['peak_rss_mb']:>9.1f}{latency['p50']:>9.2f}"
+              f"{latency['p95']:>9.2f}{latency['p99']:>9.2f}  {identity}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark fst_decoder.py configurations')
+    parser.add_argument('--configs', default=','.join(CONFIGS),
+                       help=f"Comma-separated configurations to run (default: all of {','.join(CONFIGS)})")
+    parser.add_argument('--datasets', default=','.join(DATASETS),
+                       help='Comma-separated input files, relative to the decoder directory '
+                            '(the shipped ones get the decoder arguments they need)')
+    parser.add_argument('--scale', type=int, default=0,
+                       help='Also run on synthetic datasets repeated this many times (shuffled)')
+    parser.add_argument('--seed', type=int, default=1, help='Shuffle seed for scaled datasets')
+    parser.add_argument('--repeat', type=int, default=1, help='Runs per measurement; the fastest is kept')
+    parser.add_argument('--output', metavar='FILE', help='Write the results as JSON')
+    parser.add_argument('--baseline', metavar='FILE', help='Baseline JSON to compare against')
+    parser.add_argument('--save-baseline', metavar='FILE', help='Write the results as a new baseline')
+    parser.add_argument('--max-slowdown', type=float, default=0.10,
+                       help='Allowed fractional throughput drop against the baseline')
+    parser.add_argument('--max-startup-growth', type=float, default=0.25,
+                       help='Allowed fractional startup time growth against the baseline')
+    parser.add_argument('--max-rss-growth', type=float, default=0.10,
+                       help='Allowed fractional peak RSS growth against the baseline')
+
+    args = parser.parse_args()
+
+    names = [name for name in args.configs.split(',') if name]
+    unknown = [name for name in names if name not in CONFIGS]
+    if unknown:
+        sys.stderr.write(f"Error: unknown configurations: {', '.join(unknown)}\n")
+        sys.exit(1)
+    # The reference decode runs first so that the other outputs can be checked against it
+    if REFERENCE in names:
+        names.remove(REFERENCE)
+    names.insert(0, REFERENCE)
+
+    results = []
+    with tempfile.TemporaryDirectory(prefix='fst_bench.') as tmp_dir:
+        datasets = [(os.path.join(DECODER_DIR, path), DATASETS.get(path, []))
+                    for path in args.datasets.split(',') if path]
+        if args.scale > 1:
+            datasets += [(scaled_dataset(path, args.scale, args.seed, tmp_dir), dataset_args)
+                         for path, dataset_args in list(datasets)]
+
+        for dataset, dataset_args in datasets:
+            reference_outputs = {}
+            for name in names:
+                sys.stderr.write(f"Running {name} on {os.path.basename(dataset)}...\n")
+                results.append(benchmark(name, dataset, dataset_args, args, tmp_dir, reference_outputs))
+
+    print_table(results)
+    report = {'python': sys.version.split()[0], 'results': results}
+
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(report, f, indent=2)
+                f.write('\n')
+
+    failed = False
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args)
+    else:
+        regressions = compare(results, {'results': []}, args)
+    for regression in regressions:
+        sys.stderr.write(f"REGRESSION: {regression}\n")
+        failed = True
+
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()
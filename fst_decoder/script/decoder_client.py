@@ -0,0 +1,84 @@
+"""
+Thin client for fst_decoder.py running in server mode (--serve).
+Sends input lines to the server and writes one response line per input line.
+Usage:
+    python ../fst_decoder.py ../config.yaml --serve unix:/tmp/fst_decoder.sock &
+    python decoder_client.py --address unix:/tmp/fst_decoder.sock < ctest.char > ctest.hyp
+"""
+
+#!/usr/bin/env python3
+import sys
+import socket
+import argparse
+import threading
+
+def connect(address):
+    """Connect to unix:PATH, a socket path, HOST:PORT or PORT"""
+    if address.startswith('unix:') or '/' in address:
+        path = address[len('unix:'):] if address.startswith('unix:') else address
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(path)
+    else:
+        host, _, port = address.rpartition(':')
+        sock = socket.create_connection((host or '127.0.0.1', int(port)))
+    return sock
+
+def send_lines(sock, input_stream, sent):
+    """Stream input lines to the server, counting them in sent['lines'], then close the sending side"""
+    try:
+        for line in input_stream:
+            if not line.endswith('\n'):
+                line += '\n'
+            sock.sendall(line.encode('utf-8'))
+            sent['lines'] += 1
+    finally:
+        sock.shutdown(socket.SHUT_WR)
+
+def main():
+    parser = argparse.ArgumentParser(description='Send lines to a running fst_decoder.py server')
+    parser.add_argument('--address', required=True,
+                       help='Server address: unix:PATH or [HOST:]PORT')
+    parser.add_argument('--input', metavar='FILE',
+                       help='Input file (default: stdin)',
+                       type=argparse.FileType('r', encoding='utf-8'),
+                       default=sys.stdin)
+    parser.add_argument('--output', metavar='FILE',
+                       help='Output file (default: stdout)',
+                       type=argparse.FileType('w', encoding='utf-8'),
+                       default=sys.stdout)
+    
+    args = parser.parse_args()
+
+    try:
+        sock = connect(args.address)
+    except (OSError, ValueError) as e:
+        sys.stderr.write(f"Error: cannot connect to {args.address}: {e}\n")
+        sys.exit(1)
+
+    # Send from a separate thread so responses are read while input is still being sent
+    sent = {'lines': 0}
+    sender = threading.Thread(target=send_lines, args=(sock, args.input, sent), daemon=True)
+    sender.start()
+
+    received = 0
+    try:
+        with sock.makefile('r', encoding='utf-8') as responses:
+            for response in responses:
+                args.output.write(response)
+                received += 1
+        sender.join()
+        if received < sent['lines']:
+            sys.stderr.write(f"Error: {sent['lines']} lines sent but only {received} responses received\n")
+            sys.exit(1)
+    except IOError as e:
+        sys.stderr.write(f"Error: {e}\n")
+        sys.exit(1)
+    finally:
+        sock.close()
+        if args.input is not sys.stdin:
+            args.input.close()
+        if args.output is not sys.stdout:
+            args.output.close()
+
+if __name__ == '__main__':
+    main()